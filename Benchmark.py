@@ -0,0 +1,200 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+
+import chess
+
+import Player
+import MCTS
+import ChessGame
+import OpeningBook
+import SearchBoard
+
+# Positions with known move generation node counts, as (name, fen, nodes at depth 1, 2, ...).
+# The full benchmark searches the deepest depth and --quick the one before it.
+PERFT_POSITIONS = [
+    ("start", chess.STARTING_FEN, [20, 400, 8902]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", [48, 2039]),
+    ("endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", [14, 191, 2812]),
+    ("promotions", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1", [6, 264, 9467]),
+]
+
+
+def perft(board, depth):
+    """Number of leaf boards reached by making every legal move to the given depth."""
+    if depth == 0:
+        return 1
+    nodes = 0
+    for move in board.legal_moves:
+        board.push(move)
+        nodes += perft(board, depth - 1)
+        board.pop()
+    return nodes
+
+
+def result(value, unit, higher_is_better=True, **details):
+    """A single measurement as it is written to the JSON output."""
+    return dict(value=value, unit=unit, higher_is_better=higher_is_better, **details)
+
+
+def bench_perft(quick):
+    """Move generation speed on the perft positions, checking the node counts."""
+    results = {}
+    for name, fen, counts in PERFT_POSITIONS:
+        depth = len(counts) - 1 if quick else len(counts)
+        expected = counts[depth - 1]
+        # The same counts on both board backends.
+        for prefix, board in (("perft", chess.Board(fen)), ("perft_bitboard", SearchBoard.SearchBoard(chess.Board(fen)))):
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+            if nodes != expected:
+                raise AssertionError(f"Perft of {name} to depth {depth} is {nodes}, should be {expected}.")
+            results[f"{prefix}_{name}"] = result(nodes / elapsed, "nodes/s", depth=depth, nodes=nodes)
+    return results
+
+
+def bench_heuristic(quick):
+    """Evaluations per second of Player.heuristic with the feature cache turned off."""
+    player = Player.MMPlayer()
+    boards = [chess.Board(fen) for fen in ChessGame.Game.boards]
+    boards += [chess.Board(fen) for name, fen, counts in PERFT_POSITIONS]
+    repeats = 20 if quick else 200
+    cache = Player.Player.feature_cache
+    Player.Player.feature_cache = None
+    try:
+        start = time.perf_counter()
+        for i in range(repeats):
+            for board in boards:
+                player.setPlayer(board.turn)
+                player.heuristic(board)
+        elapsed = time.perf_counter() - start
+    finally:
+        Player.Player.feature_cache = cache
+    return {"heuristic" : result(repeats * len(boards) / elapsed, "evals/s")}
+
+
+def bench_minimax(quick):
+    """Nodes per second of a fixed depth MMPlayer search on each of Game.boards."""
+    depth = 2 if quick else 3
+    results = {}
+    for index, fen in enumerate(ChessGame.Game.boards):
+        # A new player for every board so nothing is reused between searches.
+        player = Player.MMPlayer(depth)
+        if Player.Player.feature_cache is not None:
+            Player.Player.feature_cache.clear()
+        board = chess.Board(fen)
+        player.setPlayer(board.turn)
+        start = time.perf_counter()
+        player.search_for_move(board)
+        elapsed = time.perf_counter() - start
+        results[f"minimax_board{index}"] = result(player.nodes / elapsed, "nodes/s", depth=depth,
+                                                  nodes=player.nodes, seconds=elapsed)
+    return results
+
+
+def bench_mcts(quick):
+    """Iterations per second of MCTSPlayer on a middlegame board."""
+    random.seed(0)
+    max_time = 1 if quick else 5
+    player = MCTS.MCTSPlayer(max_time=max_time)
+    board = chess.Board(ChessGame.Game.boards[1])
+    player.setPlayer(board.turn)
+    start = time.perf_counter()
+    player.search_for_move(board)
+    elapsed = time.perf_counter() - start
+    return {"mcts" : result(player.iter / elapsed, "iterations/s", iterations=player.iter)}
+
+
+def bench_book(quick):
+    """Time to open the compiled opening book and look up the starting position."""
+    book = OpeningBook.OpeningBook()
+    # Make sure the file is built, so only opening it is timed.
+    book.load()
+    book = OpeningBook.OpeningBook()
+    start = time.perf_counter()
+    book.moves(chess.Board())
+    elapsed = time.perf_counter() - start
+    return {"book_load" : result(elapsed, "s", higher_is_better=False)}
+
+
+BENCHMARKS = {
+    "perft" : bench_perft,
+    "heuristic" : bench_heuristic,
+    "minimax" : bench_minimax,
+    "mcts" : bench_mcts,
+    "book" : bench_book,
+}
+
+
+def run(names, quick=False):
+    """Run the named benchmarks and return their results."""
+    results = {}
+    for name in names:
+        results.update(BENCHMARKS[name](quick))
+    return {
+        "python" : platform.python_version(),
+        "backend" : Player.SearchingPlayer.board_backend,
+        "selective" : [name for name in ("null_move", "late_move_reductions", "futility_pruning")
+                       if getattr(Player.MMPlayer, name)],
+        "machine" : platform.machine(),
+        "quick" : quick,
+        "results" : results,
+    }
+
+
+def compare(report, baseline, threshold):
+    """Measurements that are more than threshold (a fraction) worse than the baseline."""
+    regressions = []
+    for name, current in report["results"].items():
+        previous = baseline["results"].get(name)
+        if previous is None or not previous["value"]:
+            continue
+        change = current["value"] / previous["value"] - 1
+        worse = -change if current["higher_is_better"] else change
+        if worse > threshold:
+            regressions.append({"name" : name, "baseline" : previous["value"],
+                                "value" : current["value"], "change" : change})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure search and evaluation throughput.")
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run, any of {', '.join(BENCHMARKS)}, all of them by default")
+    parser.add_argument("--quick", action="store_true", help="smaller scenarios for a fast check")
+    parser.add_argument("--save", help="write the results to this file as a baseline")
+    parser.add_argument("--baseline", help="compare against the results saved in this file")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction a measurement may be worse than the baseline (default 0.1)")
+    parser.add_argument("--backend", choices=Player.SearchingPlayer.BACKENDS,
+                        default=Player.SearchingPlayer.board_backend,
+                        help="board the minimax and mcts searches make their moves on")
+    parser.add_argument("--selective", action="store_true",
+                        help="turn on null move pruning, late move reductions and futility pruning in minimax")
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}")
+    Player.SearchingPlayer.board_backend = args.backend
+    if args.selective:
+        Player.MMPlayer.null_move = True
+        Player.MMPlayer.late_move_reductions = True
+        Player.MMPlayer.futility_pruning = True
+
+    report = run(args.benchmarks or list(BENCHMARKS), args.quick)
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            report["regressions"] = compare(report, json.load(file), args.threshold)
+    print(json.dumps(report, indent=2))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(report, file, indent=2)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,7 @@ import time
 import chess
 import Player
 import MCTS
+import SearchStats
 from math import inf
 import numpy as np
 
@@ -12,10 +13,14 @@ class Game():
               "1k6/3R4/2Q5/8/8/8/8/1K6 w - - 0 2",
               "1k6/4R3/8/2Q5/8/8/8/1K6 w - - 0 2"]
     """Class for running the game of Chess."""
-    def __init__(self, player1, player2, start = 0):
-        """Initialize the board and players."""
+    def __init__(self, player1, player2, start = 0, record_stats = False, stats_sink = None, game_store = None):
+        """Initialize the board and players.
+           With record_stats or a stats_sink the search statistics of every move
+           are kept in move_stats, and also passed to the sink if there is one.
+           Finished games are appended to the game_store if there is one.
+           start is an index into boards or a chess.Board to play on from."""
         # Chess board
-        self.board = chess.Board(Game.boards[start])
+        self.board = start.copy() if isinstance(start, chess.Board) else chess.Board(Game.boards[start])
         # Player object for white.
         self.white = player1
         self.white.setPlayer(chess.WHITE)
@@ -24,12 +29,40 @@ class Game():
         self.black.setPlayer(chess.BLACK)
         # Player object of the players who's turn it is.
         self.current_player = None
+        # Search statistics of each move, as dictionaries.
+        self.move_stats = []
+        self.stats_sink = stats_sink
+        # GameStore.GameStore the game is written to when it ends.
+        self.game_store = game_store
+        # Whether the game was stopped by the timer and given to the pseudo winner.
+        self.adjudicated = False
+        if record_stats or stats_sink is not None:
+            self.white.stats_callback = self.recordStats
+            self.black.stats_callback = self.recordStats
+
+    def recordStats(self, stats):
+        """Keep the statistics of a move and pass them on to the sink."""
+        record = stats.to_dict()
+        self.move_stats.append(record)
+        if self.stats_sink is not None:
+            self.stats_sink(record)
+
+    def stats_summary(self):
+        """Statistics of the game so far, for each player and in total."""
+        return {
+            "white" : SearchStats.summarize([r for r in self.move_stats if r["player"] == "white"]),
+            "black" : SearchStats.summarize([r for r in self.move_stats if r["player"] == "black"]),
+            "total" : SearchStats.summarize(self.move_stats)
+        }
 
     def nextTurn(self):
         """Finds the next move to make based on what
             type of player is the current player"""
         # Selecting the current player based on the boards turn.
         self.current_player = self.white if self.board.turn else self.black
+        opponent = self.black if self.board.turn else self.white
+        # The opponent's move is known, so the player's background search can stop.
+        self.current_player.stopPondering(self.board)
         # Variable to hold the move to make.
         move = None
         while True:
@@ -44,17 +77,33 @@ class Game():
 
         # Make the next move on the board.
         self.board.push(move)
+        # Keep the player searching while the opponent waits for input.
+        if self.current_player.ponder and opponent.waits_for_input:
+            self.current_player.startPondering(self.board)
+
+    def store(self, winner = None):
+        """Write the finished game to the game store."""
+        if self.game_store is not None:
+            self.game_store.append(self.board, winner, self.adjudicated)
+
+    def stop_pondering(self):
+        """Stop the background searches of both players once the game is over."""
+        self.white.stopPondering(self.board)
+        self.black.stopPondering(self.board)
 
     def run(self):
         """Runs the game until termination."""
         # Loop to get the next turn repeatedly until the game is terminated.
         start = time.perf_counter()
-        while self.board.outcome() is None:
+        # The outcome of the game, a chess.Outcome object, computed once per turn.
+        outcome = self.board.outcome()
+        while outcome is None:
             print("\n" + str(self.board))
             print(Player.static_cost_heuristic(self.board))
             self.nextTurn()
-        # The outcome of the game, a chess.Outcome object.
-        outcome = self.board.outcome()
+            outcome = self.board.outcome()
+        self.stop_pondering()
+        self.store()
         print("\n" + str(self.board) + "\n")
 
         # Checks if the type of termination is checkmate.
@@ -68,6 +117,12 @@ class Game():
     def pseudo_winner(self):
         """Returns a pseudo winner for when the game has gone on for too long."""
 
+        # Boards in the endgame tables have a known winner, None for a draw.
+        endgame = Player.Player.endgames.probe(self.board)
+        if endgame is not None:
+            print("Endgame table", "draw" if endgame[0] is None else "White" if endgame[0] else "Black")
+            return endgame[0]
+
         # Get how good each player thinks the board state is.
         white_heuristic = self.white.heuristic(self.board)
         black_heuristic = self.black.heuristic(self.board)
@@ -102,14 +157,21 @@ class Game():
         """Runs the game until termination without print statements for simulating games."""
         # Loop to get the next turn repeatedly until the game is terminated.
         start = time.perf_counter()
-        while self.board.outcome() is None:
+        # The outcome of the game, a chess.Outcome object, computed once per turn.
+        outcome = self.board.outcome()
+        while outcome is None:
             # Checks if the game has gone on for longer than the timer allows.
             if time.perf_counter() - start > timer:
                 # Returns a pseudo winner of the current board state.
-                return self.pseudo_winner()
+                self.stop_pondering()
+                winner = self.pseudo_winner()
+                self.adjudicated = True
+                self.store(winner)
+                return winner
             self.nextTurn()
-        # The outcome of the game, a chess.Outcome object.
-        outcome = self.board.outcome()
+            outcome = self.board.outcome()
+        self.stop_pondering()
+        self.store()
         return outcome.winner
 
     def test(self, n):
@@ -118,17 +180,18 @@ class Game():
         for i in range(n):
             print(f'Game: {i}')
             self.board = chess.Board()
+            # The outcome of the game, a chess.Outcome object, computed once per turn.
+            outcome = self.board.outcome()
             # Loop to get the next turn repeatedly until the game is terminated.
-            while self.board.outcome() is None:
+            while outcome is None:
                 print(str(self.board) + "\n")
                 self.nextTurn()
+                outcome = self.board.outcome()
                 if(self.board.fullmove_number > 50):
                     if Player.static_cost_heuristic(self.board) > 0:
                         wins += 1
                     break
-            if self.board.outcome() is None: continue
-            # The outcome of the game, a chess.Outcome object.
-            outcome = self.board.outcome()
+            if outcome is None: continue
             print("\n" + str(self.board) + "\n")
 
             # Checks if the type of termination is checkmate.
@@ -147,6 +210,8 @@ class Game():
 if __name__ == '__main__':
     player1 = Player.ManualPlayer()
     player2 = Player.MMPlayer(3, [3.60064094, 0.38716703, 0.11878024, 0.57353825, 3.18219669, 4.83386152])
+    # Search during the human's turn.
+    player2.ponder = True
     game = Game(player1,player2, 0).run()
 
     """
@@ -0,0 +1,373 @@
+import argparse
+import functools
+import os
+import time
+
+import numpy as np
+import chess
+
+# The generated tables, next to this file.
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "endgames")
+
+# The pieces the strong side has besides its king in each table, in the order of the table's axes.
+# The weak side only has its king.
+ENDGAMES = {
+    "KQK" : [chess.QUEEN],
+    "KRK" : [chess.ROOK],
+    "KPK" : [chess.PAWN],
+    "KQRK" : [chess.QUEEN, chess.ROOK]
+}
+# Order of the piece types in the names and axes of the tables.
+PIECE_ORDER = [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT, chess.PAWN]
+
+# Each table is a uint8 array indexed by [side to move, strong king, weak king, pieces...],
+# side 0 is the strong side and 1 the weak side. A value is the number of plies to mate
+# plus one, DRAW for a draw and ILLEGAL for a position that can not occur.
+DRAW = 0
+ILLEGAL = 255
+# Plies to mate of positions that are not known to be won while the tables are generated.
+INF = np.iinfo(np.int16).max
+
+SQUARES = np.arange(64)
+RANKS = SQUARES // 8
+FILES = SQUARES % 8
+KING_DISTANCE = np.maximum(np.abs(RANKS[:, None] - RANKS[None, :]), np.abs(FILES[:, None] - FILES[None, :]))
+KING_STEPS = [(dr, df) for dr in (-1, 0, 1) for df in (-1, 0, 1) if dr or df]
+SLIDES = {
+    chess.QUEEN : KING_STEPS,
+    chess.ROOK : [(1, 0), (-1, 0), (0, 1), (0, -1)],
+    chess.BISHOP : [(1, 1), (1, -1), (-1, 1), (-1, -1)]
+}
+KNIGHT_JUMPS = [(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2), (-2, -1), (-2, 1), (-1, 2)]
+
+
+def mask_table(masks):
+    """A (64, 64) boolean table of one bitboard per square."""
+    return np.array([[bool(mask & chess.BB_SQUARES[square]) for square in chess.SQUARES] for mask in masks])
+
+
+@functools.lru_cache(maxsize=None)
+def line_tables():
+    """The attacks of each piece type of the strong side (white) on an empty board,
+       as {piece type : (64, 64) table}, and between, where between[a, b, c] is True
+       if c is on the line strictly between a and b. Only generating needs them,
+       so they are made on first use rather than when the module is imported."""
+    attacks = {
+        chess.PAWN : mask_table(chess.BB_PAWN_ATTACKS[chess.WHITE]),
+        chess.KNIGHT : mask_table(chess.BB_KNIGHT_ATTACKS),
+        chess.BISHOP : mask_table([chess.BB_DIAG_ATTACKS[s][0] for s in chess.SQUARES]),
+        chess.ROOK : mask_table([chess.BB_RANK_ATTACKS[s][0] | chess.BB_FILE_ATTACKS[s][0] for s in chess.SQUARES]),
+        chess.QUEEN : mask_table([chess.BB_RANK_ATTACKS[s][0] | chess.BB_FILE_ATTACKS[s][0] | chess.BB_DIAG_ATTACKS[s][0]
+                                  for s in chess.SQUARES])
+    }
+    between = np.array([mask_table([chess.between(a, b) for b in chess.SQUARES]) for a in chess.SQUARES])
+    return attacks, between
+
+
+def table_name(piece_types):
+    """The name of the table of the strong side's pieces besides its king."""
+    pieces = sorted(piece_types, key=PIECE_ORDER.index)
+    return "K" + "".join(chess.piece_symbol(piece_type).upper() for piece_type in pieces) + "K"
+
+
+def table_path(name, directory=TABLE_DIR):
+    return os.path.join(directory, f"{name}.npy")
+
+
+def shift(array, axis, ranks, files, fill):
+    """The array with the square on axis moved by ranks and files,
+       out[..., s, ...] is array[..., s + (ranks, files), ...] and fill off the board."""
+    shape = array.shape
+    view = array.reshape(shape[:axis] + (8, 8) + shape[axis + 1:])
+    out = np.full_like(view, fill)
+
+    def span(delta):
+        return slice(max(delta, 0), 8 + min(delta, 0)), slice(max(-delta, 0), 8 + min(-delta, 0))
+
+    (source_ranks, target_ranks), (source_files, target_files) = span(ranks), span(files)
+    lead = (slice(None),) * axis
+    out[lead + (target_ranks, target_files)] = view[lead + (source_ranks, source_files)]
+    return out.reshape(shape)
+
+
+def decode(values):
+    """Plies to mate (INF if not won) and legality of one side of a stored table."""
+    legal = values != ILLEGAL
+    plies = np.where(legal & (values != DRAW), values.astype(np.int16) - 1, INF).astype(np.int16)
+    return plies, legal
+
+
+def load_sides(name, directory=TABLE_DIR):
+    """Plies to mate and legality of both sides of a table, (0, True) for a bare king against a king."""
+    if name == "KK":
+        legal = KING_DISTANCE > 1
+        return (np.full((64, 64), INF, dtype=np.int16), legal), (np.full((64, 64), INF, dtype=np.int16), legal)
+    values = np.load(table_path(name, directory))
+    return decode(values[0]), decode(values[1])
+
+
+def generate(name, directory=TABLE_DIR):
+    """Distances to mate of every position of the table by retrograde analysis.
+
+    Every position is given an axis per piece, so the moves of a piece are the
+    array shifted along its axis and the positions won in n plies are found
+    from the ones lost in n - 1 with whole array operations. The tables of
+    positions after a capture or a promotion must have been generated first."""
+    piece_types = ENDGAMES[name]
+    axes = 2 + len(piece_types)
+    shape = (64,) * axes
+    # The square of each piece broadcast along its axis, the kings first.
+    coords = [SQUARES.reshape([64 if i == axis else 1 for i in range(axes)]) for axis in range(axes)]
+    strong_king, weak_king = coords[0], coords[1]
+    pieces = coords[2:]
+
+    # Positions with every piece on its own square, the kings apart and no pawn on the back ranks.
+    legal = np.broadcast_to(KING_DISTANCE[strong_king, weak_king] > 1, shape).copy()
+    for a in range(axes):
+        for b in range(a + 1, axes):
+            legal &= coords[a] != coords[b]
+    for piece_type, square in zip(piece_types, pieces):
+        if piece_type == chess.PAWN:
+            legal &= (RANKS[square] > 0) & (RANKS[square] < 7)
+    # occupied[i] is True if another piece is on the square of piece i.
+    occupied = []
+    for i in range(len(piece_types)):
+        occupied.append(np.zeros(shape, dtype=bool))
+        for a in range(axes):
+            if a != 2 + i:
+                occupied[i] |= coords[2 + i] == coords[a]
+    # Whether the weak king is attacked, the pieces of the strong side block each other's lines.
+    attacks, between = line_tables()
+    attacked = np.zeros(shape, dtype=bool)
+    for i, (piece_type, square) in enumerate(zip(piece_types, pieces)):
+        hits = attacks[piece_type][square, weak_king]
+        if piece_type in SLIDES:
+            for other in [strong_king] + pieces[:i] + pieces[i + 1:]:
+                hits = hits & ~between[square, weak_king, other]
+        attacked |= hits
+    # With the strong side to move the weak king can not be in check.
+    legal_strong = legal & ~attacked
+    legal_weak = legal
+
+    # Plies to mate of each side, the strong side always wins or draws.
+    strong = np.full(shape, INF, dtype=np.int16)
+    weak = np.full(shape, INF, dtype=np.int16)
+    # The weak king capturing a piece leads to a position of a smaller table. These positions
+    # are illegal here, so the smaller table's values are kept in their place.
+    reachable = legal_strong.copy()
+    for i in range(len(piece_types)):
+        rest = piece_types[:i] + piece_types[i + 1:]
+        (plies, sub_legal), _ = load_sides(table_name(rest) if rest else "KK", directory)
+        index = list(np.indices(plies.shape))
+        index.insert(2 + i, index[1])
+        strong[tuple(index)] = plies
+        reachable[tuple(index)] = sub_legal
+    # Promotions lead to positions of a smaller table with the weak side to move.
+    promotions = []
+    for i, piece_type in enumerate(piece_types):
+        if piece_type != chess.PAWN:
+            continue
+        for promotion in (chess.QUEEN, chess.ROOK):
+            promoted = piece_types[:i] + [promotion] + piece_types[i + 1:]
+            if table_name(promoted) not in ENDGAMES:
+                continue
+            _, (plies, sub_legal) = load_sides(table_name(promoted), directory)
+            # Put the axes of the smaller table in the order of this one.
+            order = sorted(range(len(promoted)), key=lambda j: PIECE_ORDER.index(promoted[j]))
+            permutation = [0, 1] + [2 + order.index(j) for j in range(len(promoted))]
+            plies = np.transpose(plies, permutation)
+            sub_legal = np.transpose(sub_legal, permutation)
+            moves = (RANKS[pieces[i]] == 6) & shift(sub_legal & ~occupied[i], 2 + i, 1, 0, False)
+            promotions.append(np.where(moves, shift(plies, 2 + i, 1, 0, INF), INF))
+
+    # The weak side's moves, the king stepping to squares where it is not in check.
+    weak_moves = [shift(reachable, 1, dr, df, False) for dr, df in KING_STEPS]
+    has_move = np.logical_or.reduce(weak_moves)
+    weak[legal_weak & attacked & ~has_move] = 0
+    # The stalemates are draws and never found below, as they have no moves.
+
+    def strong_reaches(target):
+        """Strong side positions with a move to a weak side position in target."""
+        hit = np.zeros(shape, dtype=bool)
+        for dr, df in KING_STEPS:
+            # Positions in target are legal, so a king move to one is legal.
+            hit |= shift(target, 0, dr, df, False)
+        for i, piece_type in enumerate(piece_types):
+            axis = 2 + i
+            if piece_type == chess.PAWN:
+                hit |= shift(target, axis, 1, 0, False)
+                hit |= (RANKS[pieces[i]] == 1) & ~shift(occupied[i], axis, 1, 0, True) & shift(target, axis, 2, 0, False)
+            elif piece_type == chess.KNIGHT:
+                for dr, df in KNIGHT_JUMPS:
+                    hit |= shift(target, axis, dr, df, False)
+            else:
+                for dr, df in SLIDES[piece_type]:
+                    clear = np.ones(shape, dtype=bool)
+                    for k in range(1, 8):
+                        hit |= clear & shift(target, axis, k * dr, k * df, False)
+                        clear &= ~shift(occupied[i], axis, k * dr, k * df, True)
+                        if not clear.any():
+                            break
+        return hit
+
+    # The longest mate that a capture or promotion can lead to, the search goes on at least until then.
+    seeds = [plies[plies < INF].max(initial=0) for plies in [strong[~legal_strong & reachable]] + promotions]
+    longest = int(max(seeds))
+    n = 1
+    empty = 0
+    while empty < 2 or n <= longest + 1:
+        if n % 2:
+            # Won for the strong side if a move leads to a position lost in n - 1.
+            found = strong_reaches(weak == n - 1)
+            for plies in promotions:
+                found |= plies == n - 1
+            new = legal_strong & (strong == INF) & found
+            strong[new] = n
+        else:
+            # Lost for the weak side if every move leads to a position won in at most n - 1.
+            lost = has_move.copy()
+            for (dr, df), moves in zip(KING_STEPS, weak_moves):
+                lost &= ~moves | (shift(strong, 1, dr, df, INF) <= n - 1)
+            new = legal_weak & (weak == INF) & lost
+            weak[new] = n
+        empty = 0 if new.any() else empty + 1
+        n += 1
+
+    values = np.full((2,) + shape, ILLEGAL, dtype=np.uint8)
+    for side, (plies, side_legal) in enumerate([(strong, legal_strong), (weak, legal_weak)]):
+        if (plies[side_legal & (plies < INF)] >= ILLEGAL - 1).any():
+            raise ValueError(f"A mate in {name} is too long to store.")
+        values[side][side_legal] = np.where(plies < INF, plies + 1, DRAW)[side_legal]
+    return values
+
+
+def build(names=None, directory=TABLE_DIR, force=False):
+    """Generate the tables and write them to directory, smaller tables first.
+       Returns the seconds each table took."""
+    os.makedirs(directory, exist_ok=True)
+    # ENDGAMES lists the tables of captures and promotions before the tables that need them.
+    names = sorted(names if names is not None else ENDGAMES, key=lambda name: list(ENDGAMES).index(name) if name in ENDGAMES else -1)
+    times = {}
+    for name in names:
+        if name not in ENDGAMES:
+            raise ValueError(f"Unknown endgame {name}, should be one of {', '.join(ENDGAMES)}.")
+        path = table_path(name, directory)
+        if os.path.exists(path) and not force:
+            continue
+        start = time.perf_counter()
+        values = generate(name, directory)
+        # Write to a temporary file first so a reader never sees half a table.
+        temporary = f"{path}.{os.getpid()}.tmp.npy"
+        np.save(temporary, values)
+        os.replace(temporary, path)
+        times[name] = time.perf_counter() - start
+    return times
+
+
+class EndgameTables():
+    """Distance to mate tables probed with the board's material.
+
+    Each table is memory-mapped the first time a board with its material is
+    probed, a table that has not been generated is never probed again.
+    Boards where the strong side is black are mirrored, so the tables only
+    hold positions where white has the pieces."""
+
+    def __init__(self, directory=TABLE_DIR):
+        self.directory = directory
+        # Names of the tables that have been generated, found on the first probe.
+        self.generated = None
+        # Memory-mapped tables by name.
+        self.tables = {}
+
+    def table(self, name):
+        if name not in self.generated:
+            return None
+        if name not in self.tables:
+            self.tables[name] = np.load(table_path(name, self.directory), mmap_mode="r")
+        return self.tables[name]
+
+    def probe(self, board):
+        """The result of the board with perfect play, as the winner (None for a draw)
+           and the number of plies to mate, or None if the board is in no table.
+           Works on chess.Board and SearchBoard."""
+        occupied = board.occupied
+        if chess.popcount(occupied) > 4 or board.castling_rights:
+            return None
+        if self.generated is None:
+            self.generated = {name for name in ENDGAMES if os.path.exists(table_path(name, self.directory))}
+        if not self.generated:
+            return None
+        kings = board.kings
+        if chess.popcount(kings) != 2:
+            return None
+        if not occupied & ~kings:
+            return None, 0
+        if board.occupied_co[chess.WHITE] & ~kings:
+            strong = chess.WHITE
+        else:
+            strong = chess.BLACK
+        if board.occupied_co[not strong] & ~kings:
+            # Both sides have pieces.
+            return None
+        own = board.occupied_co[strong]
+        piece_types = []
+        squares = []
+        for piece_type, mask in ((chess.QUEEN, board.queens), (chess.ROOK, board.rooks), (chess.BISHOP, board.bishops),
+                                 (chess.KNIGHT, board.knights), (chess.PAWN, board.pawns)):
+            for square in chess.scan_forward(mask & own):
+                piece_types.append(piece_type)
+                squares.append(square)
+        table = self.table(table_name(piece_types))
+        if table is None:
+            return None
+        squares = [board.king(strong), board.king(not strong)] + squares
+        if strong == chess.BLACK:
+            squares = [chess.square_mirror(square) for square in squares]
+        value = int(table[(0 if board.turn == strong else 1, *squares)])
+        if value == ILLEGAL:
+            return None
+        if value == DRAW:
+            return None, 0
+        return strong, value - 1
+
+    def best_move(self, board):
+        """The move that mates fastest, holds a draw, or delays the mate longest,
+           or None if the board is in no table."""
+        result = self.probe(board)
+        if result is None:
+            return None
+        winner, plies = result
+        best = None
+        best_plies = None
+        for move in board.legal_moves:
+            board.push(move)
+            child = self.probe(board)
+            if child is None and board.is_insufficient_material():
+                # An underpromotion to a bishop or knight.
+                child = None, 0
+            board.pop()
+            if child is None or child[0] != winner:
+                continue
+            if winner is None:
+                return move
+            # The winner wants the shortest mate, the loser the longest.
+            if best is None or (child[1] < best_plies if winner == board.turn else child[1] > best_plies):
+                best = move
+                best_plies = child[1]
+        return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the endgame tables.")
+    parser.add_argument("names", nargs="*", help=f"tables to generate, all of {', '.join(ENDGAMES)} by default")
+    parser.add_argument("--directory", default=TABLE_DIR)
+    parser.add_argument("--force", action="store_true", help="generate tables that already exist again")
+    args = parser.parse_args(argv)
+
+    times = build(args.names or None, args.directory, args.force)
+    for name, seconds in times.items():
+        print(f"{name} generated in {seconds:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+import collections
+
+import numpy as np
+import chess
+
+# Material value of each piece, the same values as Player.piece_cost_heuristic.
+piece_costs = {
+    chess.PAWN : 1,
+    chess.KNIGHT : 3,
+    chess.BISHOP : 3,
+    chess.ROOK : 5,
+    chess.QUEEN : 9,
+    chess.KING : 0
+}
+
+
+def square_value(tables, piece_type, color, square):
+    """Piece square table value of a piece, the tables are written from white's side."""
+    if color == chess.WHITE:
+        return tables[piece_type][chess.square_mirror(square)]
+    return tables[piece_type][square]
+
+
+class IncrementalEvaluator():
+    """Running material and piece square table sums of a board.
+
+    The sums are kept from white's point of view and updated by the
+    difference a move makes, instead of rescanning every square of the board."""
+
+    def __init__(self, board: chess.Board, tables):
+        """Start tracking the board. tables maps piece types to piece square tables."""
+        self.tables = tables
+        self.material = 0
+        self.table = 0
+        # Sums before each move that was made, restored when it is unmade.
+        self.stack = []
+        self.reset(board)
+
+    def reset(self, board: chess.Board):
+        """Recompute both sums from scratch."""
+        self.material, self.table = self.full(board)
+        self.stack = []
+
+    def full(self, board: chess.Board):
+        """Material and piece square sums of the board computed from every piece."""
+        material = 0
+        table = 0
+        for square, piece in board.piece_map().items():
+            sign = 1 if piece.color == chess.WHITE else -1
+            material += sign * piece_costs[piece.piece_type]
+            table += sign * square_value(self.tables, piece.piece_type, piece.color, square)
+        return material, table
+
+    def values(self, player):
+        """Material and piece square sums from the point of view of the player."""
+        if player == chess.WHITE:
+            return self.material, self.table
+        return -self.material, -self.table
+
+    def push(self, board: chess.Board, move: chess.Move):
+        """Make the move on the board and update the sums by its difference."""
+        self.stack.append((self.material, self.table))
+        if move:
+            color = board.turn
+            sign = 1 if color == chess.WHITE else -1
+            piece_type = board.piece_type_at(move.from_square)
+            tables = self.tables
+
+            # The moving piece leaves its square.
+            table = -square_value(tables, piece_type, color, move.from_square)
+            material = 0
+            if move.promotion is not None:
+                material += piece_costs[move.promotion] - piece_costs[piece_type]
+                piece_type = move.promotion
+            table += square_value(tables, piece_type, color, move.to_square)
+
+            if board.is_castling(move):
+                # The rook moves as well.
+                rank = chess.square_rank(move.from_square)
+                if board.is_kingside_castling(move):
+                    rook_from, rook_to = chess.square(7, rank), chess.square(5, rank)
+                else:
+                    rook_from, rook_to = chess.square(0, rank), chess.square(3, rank)
+                table += square_value(tables, chess.ROOK, color, rook_to) - square_value(tables, chess.ROOK, color, rook_from)
+            elif board.is_capture(move):
+                # The captured piece is removed, counted from the other side.
+                if board.is_en_passant(move):
+                    captured_square = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+                else:
+                    captured_square = move.to_square
+                captured_type = board.piece_type_at(captured_square)
+                material += piece_costs[captured_type]
+                table += square_value(tables, captured_type, not color, captured_square)
+
+            self.material += sign * material
+            self.table += sign * table
+        board.push(move)
+
+    def pop(self, board: chess.Board):
+        """Unmake the last move on the board and restore the sums from before it."""
+        board.pop()
+        self.material, self.table = self.stack.pop()
+
+
+class FeatureCache():
+    """Size bounded least recently used cache of heuristic feature vectors.
+
+    The features of a board do not depend on a player's weights, so one cache
+    is shared by every player in the process."""
+
+    def __init__(self, maxsize=65536):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """The features stored for the key or None, marking them as recently used."""
+        features = self.entries.get(key)
+        if features is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return features
+
+    def put(self, key, features):
+        """Store the features, evicting the least recently used entry if the cache is full."""
+        self.entries[key] = features
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every entry and reset the counters."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        """Fraction of lookups that found their features."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def pawn_bitboards(board: chess.Board, color):
+    """Squares the pawns of the color can push to, single and double,
+       and the squares they attack towards each side."""
+    pawns = board.pawns & board.occupied_co[color]
+    empty = ~board.occupied & chess.BB_ALL
+    if color == chess.WHITE:
+        single = (pawns << 8) & empty
+        double = ((single & chess.BB_RANK_3) << 8) & empty
+        left = (pawns << 7) & ~chess.BB_FILE_H & chess.BB_ALL
+        right = (pawns << 9) & ~chess.BB_FILE_A & chess.BB_ALL
+    else:
+        single = (pawns >> 8) & empty
+        double = ((single & chess.BB_RANK_6) >> 8) & empty
+        left = (pawns >> 9) & ~chess.BB_FILE_H
+        right = (pawns >> 7) & ~chess.BB_FILE_A
+    return single, double, left, right
+
+
+def mobility(board: chess.Board, color):
+    """Number of squares the pieces of the color can move to.
+
+    Counted from the attack bitboards of the board itself: squares a piece
+    attacks that do not hold one of its own pieces, plus pawn pushes onto empty
+    squares and pawn captures. Castling, en passant and legality are ignored."""
+    own = board.occupied_co[color]
+    enemy = board.occupied_co[not color]
+    count = 0
+    for square in chess.scan_forward(own & ~board.pawns):
+        count += chess.popcount(board.attacks_mask(square) & ~own)
+
+    single, double, left, right = pawn_bitboards(board, color)
+    count += chess.popcount(single) + chess.popcount(double)
+    count += chess.popcount(left & enemy) + chess.popcount(right & enemy)
+    return count
+
+
+def attack_features(board: chess.Board, color):
+    """Mobility, threats and protects of the color minus those of the other color,
+    from a single pass over the attack bitboard of every piece.
+
+    Threats are the attacked squares that do not hold one of the side's own
+    pieces and protects are the attacked squares that do, each summed over
+    the pieces. Mobility is counted the same way as mobility."""
+    mobility = 0
+    threats = 0
+    protects = 0
+    for side in chess.COLORS:
+        own = board.occupied_co[side]
+        not_own = ~own & chess.BB_ALL
+        enemy = board.occupied_co[not side]
+        side_threats = 0
+        side_protects = 0
+        for square in chess.scan_forward(own & ~board.pawns):
+            attacks = board.attacks_mask(square)
+            side_threats += chess.popcount(attacks & not_own)
+            side_protects += chess.popcount(attacks & own)
+        # Other pieces can move to every square they threaten.
+        side_moves = side_threats
+
+        # Each pawn attacks at most one square towards each side,
+        # so the pawns are counted a whole side at a time.
+        single, double, left, right = pawn_bitboards(board, side)
+        side_moves += chess.popcount(single) + chess.popcount(double)
+        for attacks in (left, right):
+            side_threats += chess.popcount(attacks & not_own)
+            side_protects += chess.popcount(attacks & own)
+            side_moves += chess.popcount(attacks & enemy)
+
+        sign = 1 if side == color else -1
+        mobility += sign * side_moves
+        threats += sign * side_threats
+        protects += sign * side_protects
+    return mobility, threats, protects
+
+
+def legal_mobility(board: chess.Board, color):
+    """Number of legal moves of the color minus those of the other color.
+       The other side's moves are counted on the same board after a null move."""
+    own = sum(1 for move in board.generate_legal_moves())
+    board.push(chess.Move.null())
+    try:
+        other = sum(1 for move in board.generate_legal_moves())
+    finally:
+        board.pop()
+    return own - other if board.turn == color else other - own
+
+
+# Bitboard masks used to stop shifted bitboards wrapping around the board edges.
+NOT_A_FILE = np.uint64(0xfefefefefefefefe)
+NOT_AB_FILE = np.uint64(0xfcfcfcfcfcfcfcfc)
+NOT_H_FILE = np.uint64(0x7f7f7f7f7f7f7f7f)
+NOT_GH_FILE = np.uint64(0x3f3f3f3f3f3f3f3f)
+RANK_3 = np.uint64(chess.BB_RANK_3)
+RANK_6 = np.uint64(chess.BB_RANK_6)
+
+# Shifts of a bitboard by one square in each direction, as (left shift, right shift, mask).
+ROOK_DIRECTIONS = [(8, 0, None), (0, 8, None), (1, 0, NOT_A_FILE), (0, 1, NOT_H_FILE)]
+BISHOP_DIRECTIONS = [(9, 0, NOT_A_FILE), (7, 0, NOT_H_FILE), (0, 7, NOT_A_FILE), (0, 9, NOT_H_FILE)]
+KNIGHT_JUMPS = [(17, 0, NOT_A_FILE), (15, 0, NOT_H_FILE), (10, 0, NOT_AB_FILE), (6, 0, NOT_GH_FILE),
+                (0, 6, NOT_AB_FILE), (0, 10, NOT_GH_FILE), (0, 15, NOT_A_FILE), (0, 17, NOT_H_FILE)]
+KING_STEPS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+PAWN_CAPTURES = {
+    chess.WHITE : [(9, 0, NOT_A_FILE), (7, 0, NOT_H_FILE)],
+    chess.BLACK : [(0, 7, NOT_A_FILE), (0, 9, NOT_H_FILE)]
+}
+
+
+def shift(bitboards, direction):
+    """Move every bit of an array of bitboards one step in the direction."""
+    left, right, mask = direction
+    if left:
+        bitboards = bitboards << np.uint64(left)
+    else:
+        bitboards = bitboards >> np.uint64(right)
+    if mask is not None:
+        bitboards = bitboards & mask
+    return bitboards
+
+
+def popcount(bitboards):
+    """Number of set bits in each bitboard of an array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bitboards).astype(np.int64)
+    return unpack(bitboards).sum(axis=1, dtype=np.int64)
+
+
+def unpack(bitboards):
+    """Unpack an array of N bitboards into an (N, 64) array of squares."""
+    as_bytes = bitboards.astype("<u8").view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(as_bytes, axis=1, bitorder="little")
+
+
+def slider_counts(sliders, directions, empty, targets):
+    """Number of target squares attacked by the sliding pieces, counted once per piece.
+
+    In a single direction the ray of each piece ends at the first occupied
+    square, so the rays of different pieces never overlap and counting the
+    union of the rays counts each piece's squares separately."""
+    total = 0
+    for direction in directions:
+        ray = np.zeros_like(sliders)
+        current = sliders
+        for i in range(7):
+            current = shift(current, direction)
+            ray |= current
+            current &= empty
+        total = total + popcount(ray & targets)
+    return total
+
+
+def step_counts(pieces, steps, targets):
+    """Number of target squares attacked by the stepping pieces, counted once per piece.
+       A single step moves every piece to a different square, so no attacks overlap."""
+    total = 0
+    for step in steps:
+        total = total + popcount(shift(pieces, step) & targets)
+    return total
+
+
+def attack_counts(bitboards, color):
+    """Attacks of one side of each position.
+
+    Returns the number of attacked squares not holding one of the side's own
+    pieces, the number of squares its pieces can move to and the number of
+    attacked squares holding its own pieces, each summed over its pieces."""
+    own = bitboards["white"] if color == chess.WHITE else bitboards["black"]
+    enemy = bitboards["black"] if color == chess.WHITE else bitboards["white"]
+    occupied = own | enemy
+    empty = ~occupied
+    targets = ~own
+
+    diagonal = (bitboards["bishops"] | bitboards["queens"]) & own
+    straight = (bitboards["rooks"] | bitboards["queens"]) & own
+    knights = bitboards["knights"] & own
+    kings = bitboards["kings"] & own
+    pieces = slider_counts(diagonal, BISHOP_DIRECTIONS, empty, targets)
+    pieces = pieces + slider_counts(straight, ROOK_DIRECTIONS, empty, targets)
+    pieces = pieces + step_counts(knights, KNIGHT_JUMPS, targets)
+    pieces = pieces + step_counts(kings, KING_STEPS, targets)
+    protects = slider_counts(diagonal, BISHOP_DIRECTIONS, empty, own)
+    protects = protects + slider_counts(straight, ROOK_DIRECTIONS, empty, own)
+    protects = protects + step_counts(knights, KNIGHT_JUMPS, own)
+    protects = protects + step_counts(kings, KING_STEPS, own)
+
+    pawns = bitboards["pawns"] & own
+    pawn_threats = step_counts(pawns, PAWN_CAPTURES[color], targets)
+    pawn_captures = step_counts(pawns, PAWN_CAPTURES[color], enemy)
+    protects = protects + step_counts(pawns, PAWN_CAPTURES[color], own)
+    if color == chess.WHITE:
+        single = shift(pawns, (8, 0, None)) & empty
+        double = shift(single & RANK_3, (8, 0, None)) & empty
+    else:
+        single = shift(pawns, (0, 8, None)) & empty
+        double = shift(single & RANK_6, (0, 8, None)) & empty
+    pushes = popcount(single) + popcount(double)
+
+    return pieces + pawn_threats, pieces + pawn_captures + pushes, protects
+
+
+def bitboard_arrays(boards):
+    """Collect the bitboards of N boards into arrays of shape (N,)."""
+    columns = {
+        "white" : [], "black" : [], "pawns" : [], "knights" : [],
+        "bishops" : [], "rooks" : [], "queens" : [], "kings" : []
+    }
+    for board in boards:
+        columns["white"].append(board.occupied_co[chess.WHITE])
+        columns["black"].append(board.occupied_co[chess.BLACK])
+        columns["pawns"].append(board.pawns)
+        columns["knights"].append(board.knights)
+        columns["bishops"].append(board.bishops)
+        columns["rooks"].append(board.rooks)
+        columns["queens"].append(board.queens)
+        columns["kings"].append(board.kings)
+    return {name : np.array(column, dtype=np.uint64) for name, column in columns.items()}
+
+
+def batch_heuristics(boards, player, tables, protects_counts_threats=False):
+    """Heuristic features of many boards at once.
+
+    Returns an (N, 6) array with the same columns as Player.heuristics,
+    cost, table, advancement, mobility, threats and protects, each from the
+    point of view of player. player is a single color or one color per board.
+    Mobility, threats and protects are counted the same way as attack_features,
+    with protects_counts_threats protects is a copy of threats."""
+    return bitboard_heuristics(bitboard_arrays(boards), player, tables, protects_counts_threats)
+
+
+def bitboard_heuristics(bitboards, player, tables, protects_counts_threats=False):
+    """batch_heuristics of boards given as the arrays of bitboard_arrays,
+       so positions kept as bitboards on disk need no chess.Board."""
+    if not len(bitboards["white"]):
+        return np.zeros((0, 6))
+    colors = {chess.WHITE : bitboards["white"], chess.BLACK : bitboards["black"]}
+    piece_types = [(chess.PAWN, "pawns"), (chess.KNIGHT, "knights"), (chess.BISHOP, "bishops"),
+                   (chess.ROOK, "rooks"), (chess.QUEEN, "queens"), (chess.KING, "kings")]
+
+    # Material and piece square values from white's point of view.
+    cost = 0
+    table = 0
+    for piece_type, name in piece_types:
+        values = np.array(tables[piece_type])
+        for color, sign in ((chess.WHITE, 1), (chess.BLACK, -1)):
+            squares = unpack(bitboards[name] & colors[color])
+            cost = cost + sign * piece_costs[piece_type] * squares.sum(axis=1, dtype=np.int64)
+            # The tables are written from white's side, so white squares are mirrored.
+            square_values = values[[chess.square_mirror(s) for s in chess.SQUARES]] if color == chess.WHITE else values
+            table = table + sign * (squares @ square_values)
+
+    # Pawn advancement is how many ranks each pawn has moved from its starting rank.
+    ranks = np.arange(64) // 8 + 1
+    advancement = (unpack(bitboards["pawns"] & colors[chess.WHITE]) @ np.abs(2 - ranks)
+                   - unpack(bitboards["pawns"] & colors[chess.BLACK]) @ np.abs(7 - ranks))
+
+    white_threats, white_mobility, white_protects = attack_counts(bitboards, chess.WHITE)
+    black_threats, black_mobility, black_protects = attack_counts(bitboards, chess.BLACK)
+    threats = white_threats - black_threats
+    mobility = white_mobility - black_mobility
+    protects = threats if protects_counts_threats else white_protects - black_protects
+
+    features = np.stack([cost, table, advancement, mobility, threats, protects], axis=1).astype(float)
+    # Flip the features of boards seen from black's side.
+    sign = np.where(np.asarray(player, dtype=bool), 1, -1)
+    return features * sign.reshape(-1, 1)
@@ -0,0 +1,253 @@
+import argparse
+import os
+import struct
+
+import numpy as np
+import chess
+import chess.pgn
+
+import Player
+import Evaluation
+import OpeningBook
+
+# The binary store starts with the magic bytes, followed by one record per game.
+MAGIC = b"GAMES001"
+# Each record starts with the result, the flags, the length of the starting fen
+# and the number of moves, followed by the fen and the moves packed by encode_move.
+RECORD_HEADER = struct.Struct("<BBHI")
+# Result codes of the records, from white's point of view.
+BLACK_WIN, DRAW, WHITE_WIN, UNFINISHED = range(4)
+# Flag of a game stopped early and given to the pseudo winner.
+ADJUDICATED = 1
+RESULT_STRINGS = {BLACK_WIN : "0-1", DRAW : "1/2-1/2", WHITE_WIN : "1-0", UNFINISHED : "*"}
+RESULT_CODES = {string : code for code, string in RESULT_STRINGS.items()}
+# Score of each result code from white's point of view.
+LABELS = {BLACK_WIN : 0.0, DRAW : 0.5, WHITE_WIN : 1.0}
+
+# The columns of the packed positions, the bitboards of Evaluation.bitboard_arrays
+# and a state word with the turn, the castling rights and the en passant square.
+COLUMNS = ["white", "black", "pawns", "knights", "bishops", "rooks", "queens", "kings", "state"]
+# Castling rooks in the order of the state word's castling bits.
+CASTLING_SQUARES = [chess.H1, chess.A1, chess.H8, chess.A8]
+
+
+def result_code(winner):
+    """The result code of a game won by winner, a color or None for a draw."""
+    if winner is None:
+        return DRAW
+    return WHITE_WIN if winner == chess.WHITE else BLACK_WIN
+
+
+def record(board, winner=None, adjudicated=False):
+    """The game played on the board as (fen, moves, result code, adjudicated),
+       the arguments of GameStore.append_game. The result is the board's outcome
+       unless the game was adjudicated and given to winner."""
+    outcome = board.outcome()
+    if adjudicated:
+        code = result_code(winner)
+    elif outcome is not None:
+        code = result_code(outcome.winner)
+    else:
+        code = UNFINISHED
+    return board.root().fen(), list(board.move_stack), code, adjudicated
+
+
+class GameStore():
+    """Append-only file of finished games.
+
+    Every game is written and flushed as soon as it is appended, so a store
+    being written by a long run can be read at any time and a crash loses at
+    most the game being written. With format "pgn" the games are plain PGN,
+    with "binary" each move takes two bytes. The format is taken from the
+    extension of the path if it is not given, .pgn for PGN and binary otherwise."""
+
+    def __init__(self, path, format=None):
+        if format is None:
+            format = "pgn" if path.endswith(".pgn") else "binary"
+        if format not in ("pgn", "binary"):
+            raise ValueError(f"Unknown game store format {format}, should be pgn or binary.")
+        self.path = path
+        self.format = format
+        self.file = None
+
+    def open(self):
+        """Open the file for appending, starting a new binary store with the magic bytes."""
+        if self.file is None:
+            self.file = open(self.path, "ab")
+            if self.format == "binary" and self.file.tell() == 0:
+                self.file.write(MAGIC)
+        return self.file
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def append(self, board, winner=None, adjudicated=False):
+        """Append the game played on the board, won by winner if it was adjudicated."""
+        self.append_game(*record(board, winner, adjudicated))
+
+    def append_game(self, fen, moves, code, adjudicated=False):
+        """Append a game from its starting fen, its moves and its result code."""
+        if self.format == "pgn":
+            board = chess.Board(fen)
+            for move in moves:
+                board.push(move)
+            game = chess.pgn.Game.from_board(board)
+            game.headers["Result"] = RESULT_STRINGS[code]
+            if adjudicated:
+                game.headers["Termination"] = "adjudication"
+            data = (str(game) + "\n\n").encode()
+        else:
+            # The standard starting position is left out.
+            fen = b"" if fen == chess.STARTING_FEN else fen.encode()
+            encoded = np.array([OpeningBook.encode_move(move) for move in moves], dtype="<u2")
+            data = (RECORD_HEADER.pack(code, ADJUDICATED if adjudicated else 0, len(fen), len(encoded))
+                    + fen + encoded.tobytes())
+        # One write per game, so games from a crashed run are never interleaved.
+        file = self.open()
+        file.write(data)
+        file.flush()
+
+    def games(self):
+        """Every game in the store as (fen, moves, result code, adjudicated)."""
+        if not os.path.exists(self.path):
+            return
+        if self.format == "pgn":
+            with open(self.path, "r") as file:
+                while True:
+                    game = chess.pgn.read_game(file)
+                    if game is None:
+                        break
+                    code = RESULT_CODES.get(game.headers.get("Result"), UNFINISHED)
+                    adjudicated = game.headers.get("Termination") == "adjudication"
+                    yield game.board().fen(), list(game.mainline_moves()), code, adjudicated
+            return
+        with open(self.path, "rb") as file:
+            data = file.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a binary game store.")
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= len(data):
+            code, flags, fen_length, count = RECORD_HEADER.unpack_from(data, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + fen_length + 2 * count
+            if end > len(data):
+                # The last game was only partly written.
+                break
+            fen = data[start:start + fen_length].decode() or chess.STARTING_FEN
+            moves = [OpeningBook.decode_move(value)
+                     for value in np.frombuffer(data, dtype="<u2", count=count, offset=start + fen_length)]
+            yield fen, moves, code, bool(flags & ADJUDICATED)
+            offset = end
+
+    def __len__(self):
+        return sum(1 for game in self.games())
+
+
+def pack(board):
+    """The row of COLUMNS for the board."""
+    state = int(board.turn)
+    for bit, square in enumerate(CASTLING_SQUARES):
+        if board.castling_rights & chess.BB_SQUARES[square]:
+            state |= 2 << bit
+    state |= (board.ep_square if board.ep_square is not None else 64) << 5
+    return [board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.pawns, board.knights,
+            board.bishops, board.rooks, board.queens, board.kings, state]
+
+
+def unpack(row):
+    """The chess.Board of a packed row, without its move counters."""
+    row = [int(value) for value in row]
+    board = chess.Board(None)
+    for color, mask in ((chess.WHITE, row[0]), (chess.BLACK, row[1])):
+        for piece_type, pieces in zip(chess.PIECE_TYPES, row[2:8]):
+            for square in chess.scan_forward(pieces & mask):
+                board.set_piece_at(square, chess.Piece(piece_type, color))
+    state = row[8]
+    board.turn = bool(state & 1)
+    board.castling_rights = 0
+    for bit, square in enumerate(CASTLING_SQUARES):
+        if state & (2 << bit):
+            board.castling_rights |= chess.BB_SQUARES[square]
+    ep_square = (state >> 5) & 127
+    board.ep_square = ep_square if ep_square < 64 else None
+    return board
+
+
+def positions(store, skip=8, include_adjudicated=True):
+    """Every position of the store's decided games, after the first skip moves,
+       as (packed row, label, game number, ply)."""
+    for number, (fen, moves, code, adjudicated) in enumerate(store.games()):
+        if code not in LABELS or (adjudicated and not include_adjudicated):
+            continue
+        board = chess.Board(fen)
+        for ply, move in enumerate(moves):
+            board.push(move)
+            if ply + 1 >= skip:
+                yield pack(board), LABELS[code], number, ply + 1
+
+
+def export(store, prefix, skip=8, include_adjudicated=True, protects_counts_threats=False, chunk_size=65536):
+    """Write the store's positions to memory-mapped .npy files,
+       prefix.positions.npy (N, 9) uint64 rows of COLUMNS,
+       prefix.features.npy (N, 6) Player.heuristics features from white's point of view,
+       prefix.labels.npy (N,) results from white's point of view and
+       prefix.games.npy (N, 2) the game number and ply of each position.
+       Positions are written in chunks, so the store can be larger than memory.
+       Returns the number of positions."""
+    # The first pass counts the positions so the files can be made at their full size.
+    count = sum(1 for position in positions(store, skip, include_adjudicated))
+    rows = np.lib.format.open_memmap(f"{prefix}.positions.npy", mode="w+", dtype=np.uint64, shape=(count, len(COLUMNS)))
+    features = np.lib.format.open_memmap(f"{prefix}.features.npy", mode="w+", dtype=np.float32, shape=(count, 6))
+    labels = np.lib.format.open_memmap(f"{prefix}.labels.npy", mode="w+", dtype=np.float32, shape=(count,))
+    games = np.lib.format.open_memmap(f"{prefix}.games.npy", mode="w+", dtype=np.uint32, shape=(count, 2))
+
+    def flush(start, chunk):
+        end = start + len(chunk)
+        rows[start:end] = np.array([row for row, label, number, ply in chunk], dtype=np.uint64)
+        labels[start:end] = [label for row, label, number, ply in chunk]
+        games[start:end] = [(number, ply) for row, label, number, ply in chunk]
+        features[start:end] = position_features(rows[start:end], protects_counts_threats)
+        return end
+
+    start = 0
+    chunk = []
+    for position in positions(store, skip, include_adjudicated):
+        chunk.append(position)
+        if len(chunk) == chunk_size:
+            start = flush(start, chunk)
+            chunk = []
+    if chunk:
+        flush(start, chunk)
+    for array in (rows, features, labels, games):
+        array.flush()
+    return count
+
+
+def position_features(rows, protects_counts_threats=False):
+    """The (N, 6) features of packed rows from white's point of view."""
+    bitboards = {name : np.ascontiguousarray(rows[:, i]) for i, name in enumerate(COLUMNS[:8])}
+    return Evaluation.bitboard_heuristics(bitboards, chess.WHITE, Player.Player.piece_square_table,
+                                          protects_counts_threats)
+
+
+def load(prefix):
+    """The positions, features, labels and games written by export, memory-mapped read only."""
+    return tuple(np.load(f"{prefix}.{name}.npy", mmap_mode="r") for name in ("positions", "features", "labels", "games"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export a game store to memory-mapped position arrays.")
+    parser.add_argument("store", help="game store, .pgn or binary")
+    parser.add_argument("prefix", help="the arrays are written to prefix.positions.npy, prefix.features.npy, ...")
+    parser.add_argument("--skip", type=int, default=8, help="opening moves of each game to leave out")
+    parser.add_argument("--decided-only", action="store_true", help="leave out games given to the pseudo winner")
+    args = parser.parse_args(argv)
+
+    count = export(GameStore(args.store), args.prefix, args.skip, not args.decided_only)
+    print(f"{count} positions written to {args.prefix}.*.npy")
+
+
+if __name__ == '__main__':
+    main()
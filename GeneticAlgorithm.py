@@ -1,55 +1,112 @@
+import concurrent.futures
+import os
+import random
+
 import Player
 import numpy as np
 import ChessGame
-import threading
+import SearchStats
+import GameStore
+
+def play_game(weights1, weights2, seed, timer, depth, record_stats=False, record_game=False):
+    """Runs a game of chess between two minimax players in a worker process.
+       Returns True if the first player, who plays white, wins,
+       the game's search statistics if record_stats is set
+       and the game as GameStore.record if record_game is set."""
+    # Seed the random opening choices so each game can be replayed.
+    random.seed(seed)
+    np.random.seed(seed)
+    game = ChessGame.Game(Player.MMPlayer(depth, weights1), Player.MMPlayer(depth, weights2),
+                          record_stats=record_stats)
+    winner = game.simulate(timer)
+    record = GameStore.record(game.board, winner, game.adjudicated) if record_game else None
+    return bool(winner), game.stats_summary()["total"] if record_stats else None, record
 
 class Evolution:
 
-    def __init__(self, duration: int, mutation_std: float, population_size: int, gene_size: int) -> None:
+    def __init__(self, duration: int, mutation_std: float, population_size: int, gene_size: int,
+                 workers: int = None, seed: int = None, game_time: float = 600, depth: int = 3,
+                 stats_path: str = None, store_path: str = None) -> None:
         """Initialize the values of the class and create a random population"""
-        self.pop = np.random.random_sample((population_size, gene_size)) * 5
+        # Random number generator for the population, the brackets and the seeds of each game.
+        self.rng = np.random.default_rng(seed)
+        self.pop = self.rng.random((population_size, gene_size)) * 5
         self.population_size = population_size
         self.gene_size = gene_size
         self.duration = duration
         self.mutation_std = mutation_std
+        # Number of games played at the same time, one process each.
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        # Seconds before a game is stopped and given to the pseudo winner.
+        self.game_time = game_time
+        # Search depth of the players.
+        self.depth = depth
+        # File the search statistics of each generation are appended to as JSON lines.
+        self.stats_path = stats_path
+        # Search statistics of every generation played so far, if stats_path is set.
+        self.generation_stats = []
+        # File every game is appended to as it finishes, PGN if it ends in .pgn and binary otherwise.
+        self.store = GameStore.GameStore(store_path) if store_path is not None else None
 
     def step(self) -> np.ndarray:
         """Complete one iteration of the algorithm"""
-        winners = list(range(self.population_size))
+        order = list(range(self.population_size))
+        self.rng.shuffle(order)
+        # The losers of each round of the knockout, in the order they lost.
         losers = []
-
-        while len(winners) != 1:
-            """Continue playing games of chess until there is only one player left."""
-            players = [Player.MMPlayer(3, weights) for weights in self.pop]
-            np.random.shuffle(winners)
-
-            def run_game(player1, player2):
-                """Runs a game of chess with the two players"""
-                game = ChessGame.Game(players[player1], players[player2])
-                result = game.simulate(600)
-
-                if result:
-                    winners.remove(player2)
-                    losers.append(player2)
-                else:
-                    winners.remove(player1)
-                    losers.append(player1)
-
-            print(f"starting threads, winners:{winners}")
-            threads = []
-            for i in range(int(len(winners)/2)):
-                player1 = winners[i*2]
-                player2 = winners[(i*2)+1]
-
-                thread = threading.Thread(target=run_game, args=(player1, player2))
-                thread.start()
-                threads.append(thread)
-
-            for t in threads:
-                t.join()
-            print(f"threads completed, winners: {winners}")
-
-        losers.append(winners[0])
+        # A player that has won every game so far waiting for an opponent from the same round.
+        waiting = {}
+        # Games being played, mapped to their round and players.
+        games = {}
+        # Search statistics of each finished game.
+        game_stats = []
+
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            def enter(player, round):
+                """Pairs the player with the next player to reach the same round.
+                   Games start as soon as both players are known, so a later round
+                   can be played while other games of an earlier round are still running."""
+                if round not in waiting:
+                    waiting[round] = player
+                    return
+                player1 = waiting.pop(round)
+                player2 = player
+                seed = int(self.rng.integers(2 ** 32))
+                game = pool.submit(play_game, self.pop[player1], self.pop[player2], seed, self.game_time, self.depth,
+                                   self.stats_path is not None, self.store is not None)
+                games[game] = (round, player1, player2)
+
+            for player in order:
+                enter(player, 0)
+
+            print(f"starting games, players:{order}")
+            while games:
+                done, running = concurrent.futures.wait(games, return_when=concurrent.futures.FIRST_COMPLETED)
+                for game in done:
+                    round, player1, player2 = games.pop(game)
+                    result, stats, record = game.result()
+                    if record is not None:
+                        self.store.append_game(*record)
+                    winner, loser = (player1, player2) if result else (player2, player1)
+                    if stats is not None:
+                        game_stats.append(stats)
+                    while len(losers) <= round:
+                        losers.append([])
+                    losers[round].append(loser)
+                    enter(winner, round + 1)
+            print(f"games completed, winner: {list(waiting.values())}")
+
+        if self.stats_path is not None:
+            summary = SearchStats.summarize(game_stats)
+            summary["generation"] = len(self.generation_stats)
+            summary["games"] = len(game_stats)
+            self.generation_stats.append(summary)
+            sink = SearchStats.JsonLinesSink(self.stats_path)
+            sink(summary)
+            sink.close()
+
+        # The winner of the final is the last player waiting for a game.
+        losers = [player for round in losers for player in round] + [waiting[max(waiting)]]
         next_generation = []
 
         # Create the next generation
@@ -63,22 +120,31 @@ class Evolution:
             # Add the mutated player to the next generation.
             next_generation.append(child)
 
+        best = self.pop[losers[-1]]
         self.pop = np.array(next_generation)
 
-        return self.pop[losers[-1]]
+        return best
 
 
     def run(self) -> np.ndarray:
         """Runs the algorithm and gets the best performing player from each generation."""
         best = np.zeros((self.duration, self.gene_size))
 
-        for i in range(self.duration):
-            best[i] = self.step()
+        try:
+            for i in range(self.duration):
+                best[i] = self.step()
+        finally:
+            self.close()
         return best
 
+    def close(self):
+        """Close the game store, once the tournament is over."""
+        if self.store is not None:
+            self.store.close()
+
     def mutate(self,genome: np.ndarray) -> np.ndarray:
         """Modifies each of the weights of the player with a normal distribution of a given standard deviation."""
-        return np.clip(np.random.normal(genome, self.mutation_std, self.gene_size), 0, 5)
+        return np.clip(self.rng.normal(genome, self.mutation_std, self.gene_size), 0, 5)
 
 if __name__ == '__main__':
 
@@ -1,8 +1,10 @@
 import random
 import time
 import chess
+import chess.polyglot
 
 import Player
+import TranspositionTable
 import math
 
 class MCTSPlayer(Player.SearchingPlayer):
@@ -14,6 +16,15 @@ class MCTSPlayer(Player.SearchingPlayer):
         self.max_depth = max_depth
         self.exploreMoves = exploreMoves
         self.iter = 0
+        # Iterations each move may use, None for no limit but the time.
+        self.max_iterations = None
+        # Number of nodes and depth of the tree after the last search.
+        self.treeSize = (0, 0)
+        # Zobrist key of the board the root belongs to, after this player's last move.
+        self.rootKey = None
+        # Board shared by the whole search, moves are made on it while
+        # descending the tree and unmade on the way back to the root.
+        self.board = None
 
     def search_for_move(self, board):
         return board.uci(self.MCTS_choice(board))
@@ -26,15 +37,14 @@ class MCTSPlayer(Player.SearchingPlayer):
         return v
 
     def select(self, cur):
-        if cur.board.turn == self.player:
+        if self.board.turn == self.player:
             return self.selectMax(cur)
         return self.selectMin(cur)
 
     def selectMax(self, cur):
         ucbMax = -math.inf
         best = None
-        for move in cur.children:
-            i = cur.children[move]
+        for i in cur.children:
             v = self.ucb(i)
             if v > ucbMax:
                 ucbMax = v
@@ -43,44 +53,53 @@ class MCTSPlayer(Player.SearchingPlayer):
     def selectMin(self, cur):
         ucbMin = math.inf
         best = None
-        for move in cur.children:
-            i = cur.children[move]
+        for i in cur.children:
             v = self.ucb(i)
             if v < ucbMin:
                 ucbMin = v
                 best = i
         return best
 
+    def descend(self, cur):
+        """Move from a node to its child by making the child's move on the shared board."""
+        self.board.push(cur.move)
+        return cur
+
+    def undo(self, ply):
+        """Unmake moves on the shared board until it is back at the given ply."""
+        while len(self.board.move_stack) > ply:
+            self.board.pop()
+
     def expand(self, cur):
         if not cur.children:
-            if cur.board.legal_moves:
-                for move in cur.board.legal_moves:
-                    n = Node(cur, move, chess.Board(cur.board.fen()))
-                    n.board.push_san(cur.board.san(move))
-                    cur.children[cur.board.uci(move)] = n
+            if self.board.legal_moves:
+                cur.children = [Node(cur, move) for move in self.board.legal_moves]
             else: return cur
-            try:
-                return cur.children[random.choice(list(cur.children.keys()))]
-            except IndexError:
-                print(cur.board)
-                print([move for move in cur.board.legal_moves])
-                print(cur.children)
-                print(cur.board.outcome().termination)
-                quit()
+            return self.descend(random.choice(cur.children))
         nPrime = self.select(cur)
-        return self.expand(nPrime)
+        return self.expand(self.descend(nPrime))
     def explore(self, cur, depth):
-        outcome = cur.board.outcome()
-        if cur.board.outcome() is not None:
-            if outcome.termination == chess.Termination.CHECKMATE:
-                v = 1 if outcome.winner == self.player else 0
-                return v,cur
-            return .5, cur
+        reward = self.reward(self.board, depth)
+        if reward is not None:
+            return reward, cur
+        return self.explore(self.expand(cur), depth + 1)
 
+    def reward(self, board, depth):
+        """Reward of a rollout that is depth moves in on the board, None if it should play on.
+           Finished games and boards in the endgame tables have known results,
+           boards max_depth moves in are scored by the heuristic."""
+        outcome = board.outcome()
+        if outcome is not None:
+            if outcome.termination == chess.Termination.CHECKMATE:
+                return 1 if outcome.winner == self.player else 0
+            return .5
+        # The result of boards in the endgame tables is known without playing on.
+        endgame = Player.Player.endgames.probe(board)
+        if endgame is not None:
+            return .5 if endgame[0] is None else 1 if endgame[0] == self.player else 0
         if depth >= self.max_depth:
-            return (self.heuristic(cur.board)+self.WINSCORE)/(self.WINSCORE*2), cur
-
-        return self.explore(self.expand(cur), depth + 1)
+            return (self.heuristic(board)+self.WINSCORE)/(self.WINSCORE*2)
+        return None
 
     def backPropogate(self, cur, reward):
         if cur is None:
@@ -90,15 +109,28 @@ class MCTSPlayer(Player.SearchingPlayer):
         self.backPropogate(cur.parent, reward)
 
     def init(self, board):
-        for move in self.root.board.legal_moves:
-            n = Node(self.root, move, chess.Board(self.root.board.fen()))
-            n.board.push_san(self.root.board.san(move))
-            self.root.children[board.uci(move)] = n
+        self.root.children = [Node(self.root, move) for move in board.legal_moves]
+    def reuse(self, board):
+        """Find the root for the board in the tree of the previous move.
+           The tree is kept if the board is the position after this player's
+           last move followed by one opponent move, otherwise a new root is made."""
+        if self.root is None or not board.move_stack:
+            return Node(None, None)
+        prev = board.pop()
+        try:
+            previous = chess.polyglot.zobrist_hash(board) == self.rootKey
+        finally:
+            board.push(prev)
+        child = self.root.child(prev) if previous else None
+        if child is None:
+            return Node(None, None)
+        # Detach the child so its siblings and the old root can be freed.
+        child.parent = None
+        return child
     def finalChoice(self):
         n = 0
         best = None
-        for move in self.root.children:
-            cur = self.root.children[move]
+        for cur in self.root.children:
             if cur.Nt == n:
                 best = max(cur, best, key=lambda x:x.Qt)
             if cur.Nt > n:
@@ -106,48 +138,111 @@ class MCTSPlayer(Player.SearchingPlayer):
                 n = cur.Nt
         return best
     def MCTS_choice(self, board):
+        self.search(board)
+        return self.choose()
+    def recordStats(self, stats):
+        if not stats.book and not stats.endgame_table:
+            stats.iterations = self.iter
+            stats.tree_size, stats.depth = self.treeSize
+
+    def choose(self):
+        """Choose the best child of the root and keep its subtree for the next turn."""
+        self.root = self.finalChoice()
+        # Keep only the subtree of the chosen move for the next turn.
+        self.root.parent = None
+        self.board.push(self.root.move)
+        self.rootKey = TranspositionTable.zobrist_key(self.board)
+        self.board.pop()
+        return self.root.move
+    def search(self, board):
+        """Grow the tree for the board until the time runs out."""
         start = time.perf_counter()
         self.iter = 0
-        if self.root is None or board.fullmove_number > 0:
-            self.root = Node(None, None, chess.Board(board.fen()))
+        # Continue from the statistics gathered for the opponent's reply.
+        self.root = self.reuse(board)
+        if not self.root.children:
             self.init(board)
-        else:
-            prev = board.pop()
-            board.push_san(board.san(prev))
-            if board.uci(prev) in self.root.children.keys():
-                print("exists")
-                self.root = self.root.children[board.uci(prev)]
-                if not self.root.children:
-                    self.init(board)
-            else:
-                self.root = Node(None, None, chess.Board(board.fen()))
-                self.init(board)
+        self.board = self.searchBoard(board)
+        #print(str(self.root))
+        self.grow(lambda: self.searching(start))
         #print(str(self.root))
-        while time.perf_counter() - start < self.time:
-            best = self.select(self.root)
+        if self.stats is not None:
+            # Measured before the root moves on to the chosen child.
+            self.treeSize = self.root.size()
+
+    def searching(self, start):
+        """Whether the search started at start may run another iteration."""
+        # At least one iteration, so there is a move to choose even with no time or an early stop.
+        if self.iter == 0:
+            return True
+        if self.max_iterations is not None and self.iter >= self.max_iterations:
+            return False
+        return time.perf_counter() - start < self.time and not self.stopEvent.is_set()
+
+    def grow(self, running):
+        """Run iterations from the root on the shared board while running() is True."""
+        rootPly = len(self.board.move_stack)
+        while running():
+            best = self.descend(self.select(self.root))
             child = self.expand(best)
+            childPly = len(self.board.move_stack)
             for i in range(self.exploreMoves):
                 reward,leaf = self.explore(child, 0)
                 self.backPropogate(leaf, reward)
+                self.undo(childPly)
+            self.undo(rootPly)
+            self.iter += 1
             #print(str(self.root))
-        #print(str(self.root))
-        self.root = self.finalChoice()
-        return self.root.move
+
+    def ponderSearch(self, board):
+        """Keep growing the tree of the board after this player's move until the opponent
+           has moved, the subtree of the reply played is then reused by the next search.
+           The expected reply is the one the tree visited most."""
+        if self.root is None or self.rootKey != TranspositionTable.zobrist_key(board):
+            return
+        if not self.root.children:
+            self.init(board)
+        self.board = self.searchBoard(board)
+        self.grow(lambda: not self.stopEvent.is_set())
+        best = max(self.root.children, key=lambda child: child.Nt)
+        self.ponderMove = best.move
 
 
 class Node():
-    def __init__(self, parent, move, board):
+    """Node of the search tree.
+
+    Only the move that leads to the node and its statistics are kept,
+    the board of a node is reached by making the moves from the root."""
+    __slots__ = ("parent", "move", "children", "Qt", "Nt")
+
+    def __init__(self, parent, move):
         self.parent = parent
         self.move = move
-        self.board = board
-        self.children = dict()
+        self.children = []
         self.Qt = 0
         self.Nt = 0
+    def size(self):
+        """Number of nodes in the subtree of the node and its depth."""
+        nodes = 0
+        depth = 0
+        stack = [(self, 0)]
+        while stack:
+            node, level = stack.pop()
+            nodes += 1
+            depth = max(depth, level)
+            stack.extend((child, level + 1) for child in node.children)
+        return nodes, depth
+    def child(self, move):
+        """The child reached by the move or None."""
+        for i in self.children:
+            if i.move == move:
+                return i
+        return None
     def __repr__(self):
-        return f"{self.board.uci(self.move)}, Qt:{self.Qt/self.Nt if self.Nt != 0 else 0}, Nt:{self.Nt}"
+        return f"{self.move.uci() if self.move else 'root'}, Qt:{self.Qt/self.Nt if self.Nt != 0 else 0}, Nt:{self.Nt}"
     def __str__(self):
         s = ""
         for i in self.children:
-            s += self.children[i].__repr__() + "\n"
+            s += i.__repr__() + "\n"
         s += "\n"
-        return s
\ No newline at end of file
+        return s
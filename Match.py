@@ -0,0 +1,274 @@
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import math
+import os
+import random
+import re
+
+import numpy as np
+import chess
+
+import Player
+import MCTS
+import ChessGame
+import GameStore
+import OpeningBook
+
+# Player classes a configuration can name.
+PLAYERS = {"MMPlayer" : Player.MMPlayer, "MCTSPlayer" : MCTS.MCTSPlayer}
+
+
+def make_player(config):
+    """A player from a configuration, a dictionary with the name of its class as "type",
+       the keyword arguments of the class as "args" and attributes to set on the
+       player, such as the search switches, as "attributes"."""
+    if config.get("type", "MMPlayer") not in PLAYERS:
+        raise ValueError(f"Unknown player type {config['type']}, should be one of {', '.join(PLAYERS)}.")
+    player = PLAYERS[config.get("type", "MMPlayer")](**config.get("args", {}))
+    for name, value in config.get("attributes", {}).items():
+        if not hasattr(player, name):
+            raise ValueError(f"{type(player).__name__} has no attribute {name}.")
+        setattr(player, name, value)
+    return player
+
+
+def read_openings(eco_path=OpeningBook.ECO_PATH, min_moves=4):
+    """The move lists of the eco.json openings with at least min_moves moves."""
+    with open(eco_path, "r") as file:
+        data = json.load(file)
+    openings = []
+    for dic in data:
+        board = chess.Board()
+        moves = [board.push_san(move) for move in re.split(r"^\d*\. | \d*\. | ", dic["moves"])[1::]]
+        if len(moves) >= min_moves:
+            openings.append(moves)
+    return openings
+
+
+def play_game(white, black, opening, seed, timer, record_game=False):
+    """Play one game between two player configurations from the opening's position
+       in a worker process. Returns the winner, a color or None for a draw,
+       whether the game was adjudicated and the game as GameStore.record if record_game is set."""
+    random.seed(seed)
+    np.random.seed(seed)
+    board = chess.Board()
+    for move in opening:
+        board.push(move)
+    game = ChessGame.Game(make_player(white), make_player(black), board)
+    # The players print their moves, which is only noise from a worker.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        winner = game.simulate(timer)
+    record = GameStore.record(game.board, winner, game.adjudicated) if record_game else None
+    return winner, game.adjudicated, record
+
+
+def score_interval(wins, draws, losses, z=1.96):
+    """The mean score per game and its confidence interval for z standard errors."""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.5, 0.0, 1.0
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    error = z * math.sqrt(variance / games)
+    return score, score - error, score + error
+
+
+def elo(score):
+    """The Elo difference that gives the expected score, infinite for a score of 0 or 1."""
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400 * math.log10(1 / score - 1)
+
+
+def expected_score(difference):
+    """The expected score of a player difference Elo stronger than its opponent."""
+    return 1 / (1 + 10 ** (-difference / 400))
+
+
+def elo_interval(wins, draws, losses, z=1.96):
+    """The Elo difference of the results and its confidence interval for z standard errors."""
+    score, lower, upper = score_interval(wins, draws, losses, z)
+    return elo(score), elo(lower), elo(upper)
+
+
+def sprt_llr(wins, draws, losses, elo0, elo1):
+    """Log likelihood ratio of the results under an Elo difference of elo1 against elo0,
+       with the normal approximation of the per game scores."""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + 0.5 * draws) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        # Results with no spread, such as only wins, are given an extra draw so they can still be decided.
+        return sprt_llr(wins, draws + 1, losses, elo0, elo1)
+    s0 = expected_score(elo0)
+    s1 = expected_score(elo1)
+    return games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+
+def sprt_bounds(alpha, beta):
+    """The log likelihood ratios at which the test accepts H0 and H1."""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+class Match():
+    """Games between two player configurations played across a pool of processes.
+
+    Each opening is drawn from eco.json and played twice with the colors
+    swapped, so neither player gains from a lucky opening or from playing
+    white more often. Results are counted from the first player's point of
+    view. With sprt set to (elo0, elo1) the match stops as soon as the
+    sequential probability ratio test accepts one of the two Elo differences,
+    H0 that the first player is elo0 stronger or H1 that it is elo1 stronger."""
+
+    def __init__(self, first, second, games=100, workers=None, seed=None, game_time=60,
+                 sprt=None, alpha=0.05, beta=0.05, store_path=None, min_moves=4):
+        """first and second are player configurations for make_player."""
+        # Fail here rather than in a worker if a configuration is wrong.
+        make_player(first)
+        make_player(second)
+        self.first = first
+        self.second = second
+        self.games = games
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.rng = random.Random(seed)
+        # Seconds before a game is stopped and given to the pseudo winner.
+        self.game_time = game_time
+        self.sprt = sprt
+        self.bounds = sprt_bounds(alpha, beta)
+        self.openings = read_openings(min_moves=min_moves)
+        # File every game is appended to as it finishes.
+        self.store = GameStore.GameStore(store_path) if store_path is not None else None
+        # Results of the first player.
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+        self.adjudicated = 0
+        # "H0" or "H1" once the test has decided.
+        self.decision = None
+
+    def played(self):
+        return self.wins + self.draws + self.losses
+
+    def llr(self):
+        if self.sprt is None:
+            return None
+        return sprt_llr(self.wins, self.draws, self.losses, *self.sprt)
+
+    def record(self, winner, first_color, adjudicated):
+        """Count a game in which the first player played first_color."""
+        if winner is None:
+            self.draws += 1
+        elif winner == first_color:
+            self.wins += 1
+        else:
+            self.losses += 1
+        self.adjudicated += adjudicated
+        if self.sprt is not None:
+            llr = self.llr()
+            if llr <= self.bounds[0]:
+                self.decision = "H0"
+            elif llr >= self.bounds[1]:
+                self.decision = "H1"
+
+    def run(self, callback=None):
+        """Play the match and return its summary.
+           callback is called with the summary after every game."""
+        # Games being played, mapped to the color of the first player.
+        running = {}
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as pool:
+            opening = None
+
+            def submit(number):
+                nonlocal opening
+                # Every pair of games shares an opening.
+                if number % 2 == 0:
+                    opening = self.rng.choice(self.openings)
+                first_color = chess.WHITE if number % 2 == 0 else chess.BLACK
+                white, black = (self.first, self.second) if first_color else (self.second, self.first)
+                future = pool.submit(play_game, white, black, opening, self.rng.getrandbits(32),
+                                     self.game_time, self.store is not None)
+                running[future] = first_color
+
+            # Only as many games are started as can run at once, so a decided test wastes little.
+            submitted = 0
+            while submitted < min(self.workers, self.games):
+                submit(submitted)
+                submitted += 1
+            while running:
+                done, pending = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    first_color = running.pop(future)
+                    winner, adjudicated, record = future.result()
+                    if record is not None:
+                        self.store.append_game(*record)
+                    self.record(winner, first_color, adjudicated)
+                    if callback is not None:
+                        callback(self.summary())
+                    if self.decision is None and submitted < self.games:
+                        submit(submitted)
+                        submitted += 1
+                if self.decision is not None:
+                    # The games still running are left to finish but not counted.
+                    break
+        if self.store is not None:
+            self.store.close()
+        return self.summary()
+
+    def summary(self):
+        """The results so far, the Elo difference of the first player with its
+           95% confidence interval and the state of the test."""
+        difference, lower, upper = elo_interval(self.wins, self.draws, self.losses)
+        summary = {
+            "games" : self.played(),
+            "wins" : self.wins,
+            "draws" : self.draws,
+            "losses" : self.losses,
+            "adjudicated" : self.adjudicated,
+            "score" : score_interval(self.wins, self.draws, self.losses)[0],
+            "elo" : difference,
+            "elo_lower" : lower,
+            "elo_upper" : upper
+        }
+        if self.sprt is not None:
+            summary["sprt"] = {"elo0" : self.sprt[0], "elo1" : self.sprt[1], "llr" : self.llr(),
+                               "bounds" : list(self.bounds), "decision" : self.decision}
+        return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play a match between two player configurations.")
+    parser.add_argument("first", help='JSON configuration of the first player, as {"type": "MMPlayer", '
+                                      '"args": {"maxDepth": 2}, "attributes": {"null_move": true}}')
+    parser.add_argument("second", help="JSON configuration of the second player")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--game-time", type=float, default=60, help="seconds before a game is adjudicated")
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"),
+                        help="stop once the test accepts one of the Elo differences")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--store", help="append the games to this game store")
+    args = parser.parse_args(argv)
+
+    match = Match(json.loads(args.first), json.loads(args.second), args.games, args.workers, args.seed,
+                  args.game_time, args.sprt, args.alpha, args.beta, args.store)
+
+    def progress(summary):
+        line = (f"{summary['games']} games +{summary['wins']} ={summary['draws']} -{summary['losses']}, "
+                f"Elo {summary['elo']:.1f} [{summary['elo_lower']:.1f}, {summary['elo_upper']:.1f}]")
+        if "sprt" in summary:
+            line += f", LLR {summary['sprt']['llr']:.2f} {summary['sprt']['bounds']}"
+        print(line, flush=True)
+
+    print(json.dumps(match.run(progress), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import chess
+
+
+class MoveOrderer():
+    """Ranks the legal moves of a board so alpha-beta search looks at the
+       moves most likely to cause a cutoff first.
+
+       The order is the hash move, captures by most valuable victim and
+       least valuable attacker (MVV-LVA), killer moves of the ply and then
+       the remaining quiet moves by their history score."""
+
+    # Base scores of each kind of move, higher scores are searched first.
+    HASH_SCORE = 1000000
+    CAPTURE_SCORE = 100000
+    KILLER_SCORE = 90000
+    # Value of each piece for MVV-LVA.
+    piece_values = {
+        chess.PAWN : 1,
+        chess.KNIGHT : 3,
+        chess.BISHOP : 3,
+        chess.ROOK : 5,
+        chess.QUEEN : 9,
+        chess.KING : 100
+    }
+
+    def __init__(self, killers_per_ply=2):
+        """Create an orderer with empty killer and history tables."""
+        self.killers_per_ply = killers_per_ply
+        # Quiet moves that caused a cutoff, indexed by ply.
+        self.killers = []
+        # Cutoff scores of quiet moves, indexed by color, from square and to square.
+        self.history = [[0] * 4096, [0] * 4096]
+
+    def clear(self):
+        """Forget all killer moves and history scores."""
+        self.killers = []
+        self.history = [[0] * 4096, [0] * 4096]
+
+    def new_search(self):
+        """Prepare for a new search. Killers belong to the old positions so they
+           are removed, history scores are halved so recent cutoffs count more."""
+        self.killers = []
+        for table in self.history:
+            for i in range(4096):
+                table[i] >>= 1
+
+    def order(self, board: chess.Board, ply, hash_move=None):
+        """Return the legal moves of the board, best candidates first."""
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history[board.turn]
+        scored = []
+        for move in board.legal_moves:
+            if move == hash_move:
+                score = MoveOrderer.HASH_SCORE
+            elif board.is_capture(move):
+                score = MoveOrderer.CAPTURE_SCORE + self.mvv_lva(board, move)
+            elif move.promotion is not None:
+                score = MoveOrderer.CAPTURE_SCORE + 10 * MoveOrderer.piece_values[move.promotion]
+            elif move in killers:
+                score = MoveOrderer.KILLER_SCORE - killers.index(move)
+            else:
+                score = history[move.from_square * 64 + move.to_square]
+            scored.append((score, move))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [move for score, move in scored]
+
+    def mvv_lva(self, board: chess.Board, move: chess.Move):
+        """Score of a capture, prefers taking valuable pieces with cheap ones."""
+        if board.is_en_passant(move):
+            victim = chess.PAWN
+        else:
+            victim = board.piece_type_at(move.to_square)
+        attacker = board.piece_type_at(move.from_square)
+        return 10 * MoveOrderer.piece_values[victim] - MoveOrderer.piece_values[attacker]
+
+    def cutoff(self, board: chess.Board, move: chess.Move, ply, depth):
+        """Record a move that caused a beta cutoff at the ply with depth plies left to search.
+           Only quiet moves are recorded, captures are already ordered first."""
+        if board.is_capture(move) or move.promotion is not None:
+            return
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.killers_per_ply:]
+        self.history[board.turn][move.from_square * 64 + move.to_square] += depth * depth
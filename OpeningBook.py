@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import random
+import re
+
+import numpy as np
+import chess
+import chess.polyglot
+
+# The opening lines and the compiled book built from them, next to this file.
+ECO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eco.json")
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eco.book")
+
+# The book file starts with a 32 byte header, the magic bytes,
+# the SHA-1 of the eco.json it was built from and the number of entries.
+MAGIC = b"ECOBOOK1"
+HEADER_SIZE = 32
+# Each entry is the Zobrist key of a position and a move played from it.
+entry_dtype = np.dtype([("key", "<u8"), ("move", "<u2")])
+
+
+def encode_move(move: chess.Move):
+    """Pack a move into 16 bits, from square, to square and promotion piece."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(value):
+    """Unpack a move packed by encode_move."""
+    value = int(value)
+    promotion = value >> 12
+    return chess.Move(value & 63, (value >> 6) & 63, promotion if promotion else None)
+
+
+def file_digest(path):
+    """SHA-1 digest of the file's contents."""
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).digest()
+
+
+def read_entries(eco_path=ECO_PATH):
+    """Replay every opening line of eco.json and return the sorted, unique
+       (key, move) entries of every position reached and the move played from it."""
+    with open(eco_path, "r") as file:
+        data = json.load(file)
+
+    entries = set()
+    for dic in data:
+        board = chess.Board()
+        moves = re.split(r"^\d*\. | \d*\. | ", dic["moves"])[1::]
+        for move in moves:
+            move = board.parse_san(move)
+            entries.add((chess.polyglot.zobrist_hash(board), encode_move(move)))
+            board.push(move)
+    return np.array(sorted(entries), dtype=entry_dtype)
+
+
+def build(eco_path=ECO_PATH, book_path=BOOK_PATH):
+    """Compile eco.json into the binary book file and return its entries."""
+    digest = file_digest(eco_path)
+    entries = read_entries(eco_path)
+    header = MAGIC + digest + np.uint32(len(entries)).tobytes()
+    # Write to a temporary file first so a reader never sees half a book.
+    temporary = f"{book_path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(header.ljust(HEADER_SIZE, b"\0"))
+        entries.tofile(file)
+    os.replace(temporary, book_path)
+    return entries
+
+
+class OpeningBook():
+    """Opening moves looked up by binary search in a memory-mapped book file.
+
+    Nothing is read until the first lookup. The book is rebuilt from eco.json
+    if the file is missing or was built from a different eco.json."""
+
+    def __init__(self, eco_path=ECO_PATH, book_path=BOOK_PATH):
+        self.eco_path = eco_path
+        self.book_path = book_path
+        self.entries = None
+
+    def load(self):
+        """Map the book file into memory, rebuilding it first if it is out of date."""
+        digest = file_digest(self.eco_path)
+        try:
+            with open(self.book_path, "rb") as file:
+                header = file.read(HEADER_SIZE)
+            if header[:8] == MAGIC and header[8:28] == digest:
+                count = int(np.frombuffer(header[28:32], dtype="<u4")[0])
+                if count == 0:
+                    self.entries = np.zeros(0, dtype=entry_dtype)
+                else:
+                    self.entries = np.memmap(self.book_path, dtype=entry_dtype, mode="r",
+                                             offset=HEADER_SIZE, shape=(count,))
+                return self.entries
+        except OSError:
+            pass
+        try:
+            build(self.eco_path, self.book_path)
+            return self.load()
+        except OSError:
+            # The book can not be written, so keep it in memory instead.
+            self.entries = read_entries(self.eco_path)
+            return self.entries
+
+    def moves(self, board: chess.Board):
+        """All book moves for the board."""
+        if self.entries is None:
+            self.load()
+        key = np.uint64(chess.polyglot.zobrist_hash(board))
+        keys = self.entries["key"]
+        start = np.searchsorted(keys, key, side="left")
+        end = np.searchsorted(keys, key, side="right")
+        moves = [decode_move(value) for value in self.entries["move"][start:end]]
+        # Hash collisions could give moves that are not legal here.
+        return [move for move in moves if board.is_legal(move)]
+
+    def choice(self, board: chess.Board):
+        """A random book move for the board or None if it is out of the book."""
+        moves = self.moves(board)
+        if not moves:
+            return None
+        return random.choice(moves)
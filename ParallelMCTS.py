@@ -0,0 +1,206 @@
+import concurrent.futures
+import os
+import random
+import time
+
+import chess
+
+import MCTS
+
+
+def replay(fen, moves):
+    """Board at the fen with the moves made on it, so the game history is kept."""
+    board = chess.Board(fen)
+    for move in moves:
+        board.push(move)
+    return board
+
+
+def root_search(fen, moves, player, settings, seed, max_iterations=None):
+    """Run an independent serial search in a worker process, of at most max_iterations.
+       Returns the visits and value of each root child and the number of iterations."""
+    random.seed(seed)
+    max_time, exploreMoves, max_depth, weights, c = settings
+    searcher = MCTS.MCTSPlayer(max_time, exploreMoves, max_depth, weights)
+    searcher.c = c
+    searcher.max_iterations = max_iterations
+    searcher.setPlayer(player)
+    searcher.search(replay(fen, moves))
+    children = {child.move: (child.Nt, child.Qt) for child in searcher.root.children}
+    return children, searcher.iter
+
+
+def rollouts(fen, moves, player, settings, count, seed):
+    """Play count random games of at most max_depth moves from the board in a worker process.
+       Returns the reward of each game, scored by MCTSPlayer.reward as the serial search scores them."""
+    rng = random.Random(seed)
+    max_time, exploreMoves, max_depth, weights, c = settings
+    evaluator = MCTS.MCTSPlayer(max_time, exploreMoves, max_depth, weights)
+    evaluator.setPlayer(player)
+    # The game history is kept so repetitions end the games as they do in the serial search.
+    board = replay(fen, moves)
+    rewards = []
+    for i in range(count):
+        depth = 0
+        while True:
+            reward = evaluator.reward(board, depth)
+            if reward is not None:
+                break
+            board.push(rng.choice(list(board.legal_moves)))
+            depth += 1
+        rewards.append(reward)
+        for j in range(depth):
+            board.pop()
+    return rewards
+
+
+class ParallelMCTSPlayer(MCTS.MCTSPlayer):
+    """Monte Carlo tree search spread over a pool of worker processes.
+
+    With mode "root" every worker grows its own tree for the whole time and
+    the trees are merged by summing the visits of each root child.
+    With mode "leaf" one tree is kept in this process, batch_size leaves are
+    selected at a time with a virtual loss on their paths so the batch does
+    not pick the same leaf, and their rollouts are played by the workers."""
+
+    def __init__(self, max_time=5, exploreMoves= 5, max_depth=5, weights= None,
+                 workers=None, mode="root", batch_size=None, virtual_loss=1):
+        super().__init__(max_time, exploreMoves, max_depth, weights)
+        if mode not in ("root", "leaf"):
+            raise ValueError(f"Unknown parallel mode {mode}, should be root or leaf.")
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.mode = mode
+        self.batch_size = batch_size if batch_size is not None else self.workers * 2
+        self.virtual_loss = virtual_loss
+        self.pool = None
+        # Visits and value of each root move summed over the workers' trees, after a root parallel search.
+        self.rootVisits = {}
+
+    def getPool(self):
+        """The worker pool, started on first use and kept for later moves."""
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        return self.pool
+
+    def close(self):
+        """Shut the worker pool down."""
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def settings(self):
+        return self.time, self.exploreMoves, self.max_depth, list(self.weights), self.c
+
+    def MCTS_choice(self, board):
+        if self.mode == "root":
+            return self.root_parallel(board)
+        self.leaf_parallel(board)
+        return self.choose()
+
+    def root_parallel(self, board):
+        """Search independent trees in every worker and merge their root children."""
+        root = board.root()
+        # The iteration limit is shared between the workers.
+        share = -(-self.max_iterations // self.workers) if self.max_iterations is not None else None
+        futures = [self.getPool().submit(root_search, root.fen(), board.move_stack, self.player,
+                                         self.settings(), random.getrandbits(32), share)
+                   for i in range(self.workers)]
+        visits = {}
+        self.iter = 0
+        for future in futures:
+            children, iterations = future.result()
+            self.iter += iterations
+            for move, (Nt, Qt) in children.items():
+                total = visits.get(move, (0, 0))
+                visits[move] = (total[0] + Nt, total[1] + Qt)
+        self.rootVisits = visits
+        # The merged statistics belong to no single tree, so nothing is kept for the next turn.
+        self.root = None
+        self.rootKey = None
+        return max(visits, key=lambda move: visits[move])
+
+    def leaf_parallel(self, board):
+        """Grow one tree, playing the rollouts of each batch of leaves in the workers."""
+        start = time.perf_counter()
+        self.iter = 0
+        self.root = self.reuse(board)
+        if not self.root.children:
+            self.init(board)
+        self.board = self.searchBoard(board)
+        rootPly = len(self.board.move_stack)
+        # The workers replay the game from its first board, the search board may not keep the history.
+        fen = board.root().fen()
+        history = list(board.move_stack)
+        pool = self.getPool()
+        while self.searching(start):
+            batch = []
+            # Leaves of this batch, each one iteration as in the serial search whether it needs a rollout or not.
+            leaves = 0
+            while leaves < self.batch_size:
+                if self.max_iterations is not None and self.iter + leaves >= self.max_iterations:
+                    break
+                leaves += 1
+                leaf = self.expand(self.descend(self.select(self.root)))
+                reward = self.reward(self.board, 0)
+                if reward is not None:
+                    # Leaves with a known result need no rollout.
+                    for j in range(self.exploreMoves):
+                        self.backPropogate(leaf, reward)
+                else:
+                    self.addVirtualLoss(leaf, 1)
+                    future = pool.submit(rollouts, fen, history + self.board.move_stack[rootPly:], self.player,
+                                         self.settings(), self.exploreMoves, random.getrandbits(32))
+                    batch.append((leaf, future))
+                self.undo(rootPly)
+            for leaf, future in batch:
+                rewards = future.result()
+                self.addVirtualLoss(leaf, -1)
+                for reward in rewards:
+                    self.backPropogate(leaf, reward)
+            self.iter += leaves
+        if self.stats is not None:
+            self.treeSize = self.root.size()
+
+    def addVirtualLoss(self, leaf, sign):
+        """Count virtual lost visits on the path from the leaf to the root,
+           sign 1 adds them and -1 removes them again.
+
+           A lost visit scores 0 for a node chosen by this player and 1 for a
+           node chosen by the opponent, so either side avoids the path."""
+        depth = 0
+        node = leaf
+        while node.parent is not None:
+            depth += 1
+            node = node.parent
+        node = leaf
+        while node.parent is not None:
+            node.Nt += sign * self.virtual_loss
+            # The root is this player's turn, so odd depths are chosen by this player.
+            if depth % 2 == 0:
+                node.Qt += sign * self.virtual_loss
+            depth -= 1
+            node = node.parent
+
+
+def measure_speedup(board, player, workers=None, mode="root", max_time=5, exploreMoves=5, max_depth=5):
+    """Search the board with the serial MCTSPlayer and with a ParallelMCTSPlayer
+       for the same time and return the iterations of each and their ratio."""
+    serial = MCTS.MCTSPlayer(max_time, exploreMoves, max_depth)
+    serial.setPlayer(player)
+    serial.MCTS_choice(board.copy())
+
+    parallel = ParallelMCTSPlayer(max_time, exploreMoves, max_depth, workers=workers, mode=mode)
+    parallel.setPlayer(player)
+    # Start the workers before timing so their start up is not counted.
+    parallel.getPool().submit(int).result()
+    try:
+        parallel.MCTS_choice(board.copy())
+    finally:
+        parallel.close()
+    return {
+        "mode" : mode,
+        "workers" : parallel.workers,
+        "serial_iterations" : serial.iter,
+        "parallel_iterations" : parallel.iter,
+        "speedup" : parallel.iter / serial.iter if serial.iter else None
+    }
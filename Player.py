@@ -1,9 +1,17 @@
 import math
 import random
+import time
+import threading
 import numpy as np
 import chess
-import json
-import re
+import TranspositionTable
+import SearchBoard
+import MoveOrdering
+import Evaluation
+import OpeningBook
+import EndgameTables
+import SearchStats
+from TranspositionTable import EXACT, LOWER, UPPER
 
 def static_cost_heuristic(board: chess.Board):
     """Cost of pieces heuristic for the board state."""
@@ -33,23 +41,6 @@ def static_cost_heuristic(board: chess.Board):
             cost -= cost_value
     return cost
 
-def get_openings():
-    with open("eco.json", "r") as file:
-        data = json.load(file)
-
-        openings = {}
-        for dic in data:
-            board = chess.Board()
-            moves = re.split("^\d*\. | \d*\. | ", dic["moves"])[1::]
-            for move in moves:
-                try:
-                    if move not in openings[board.fen()]:
-                        openings[board.fen()].append(move)
-                except KeyError:
-                    openings[board.fen()] = [move]
-                board.push_san(move)
-        return openings
-
 class Player():
     """Base Class for player objects."""
 
@@ -118,8 +109,30 @@ class Player():
     }
 
     weights = [1.36033092, 0.31278123, 1.73942063, 3.55120011, 4.46290771, 5]
+    # Tuned with protects counted as a copy of threats, see protects_counts_threats.
     weights = [3.60064094, 0.38716703, 0.11878024, 0.57353825, 3.18219669, 4.83386152]
-    opening_dict = get_openings()
+    # Opening moves from eco.json, read from the compiled book on first use.
+    book = OpeningBook.OpeningBook()
+    # Distance to mate tables of small endgames, see EndgameTables.py.
+    # Boards in a table that has been generated are played from it without searching.
+    endgames = EndgameTables.EndgameTables()
+    # Count legal moves for the mobility heuristic instead of the squares
+    # the pieces attack. Slower, but takes pins, checks and castling into account.
+    exact_mobility = False
+    # Count protects the way earlier versions did, as a copy of threats. The default
+    # weights were tuned with it, so it stays on until they are refit with Tuner.py,
+    # which counts the own pieces each piece protects unless told otherwise.
+    protects_counts_threats = True
+    # Features of recently evaluated boards, shared by every player in the process.
+    # Set to None to compute the features of every board.
+    feature_cache = Evaluation.FeatureCache()
+    # Recompute the incrementally updated sums on every evaluation and
+    # check they agree, for debugging the incremental updates.
+    check_incremental = False
+    # True for players whose moves come from input, so the opponent has time to ponder.
+    waits_for_input = False
+    # Keep searching in the background during the opponent's turn.
+    ponder = False
 
     def __init__(self, weights=None):
         """Initialize the values of the player"""
@@ -134,6 +147,12 @@ class Player():
 
         # chess.Color Enum of which color the player is.
         self.player = None
+        # Evaluation.IncrementalEvaluator tracking the board during a search.
+        self.evaluator = None
+        # Called with a SearchStats.SearchStats after every move if set.
+        self.stats_callback = None
+        # Statistics of the move being searched, None unless stats_callback is set.
+        self.stats = None
 
         if weights is None:
             self.weights = Player.weights
@@ -146,22 +165,91 @@ class Player():
     def nextMove(self, board):
         """Find the next move for the player"""
         pass
-    def heuristic(self,board):
-
+    def startPondering(self, board):
+        """Called after the player's move is made on the board, before the opponent's turn."""
+        pass
+    def stopPondering(self, board):
+        """Called before the player's turn, with the opponent's move made on the board.
+           Returns True if the background search was on the move the opponent played."""
+        return False
+    def heuristic(self,board, key=None):
+        """Weighted sum of the heuristic features of the board.
+           key is the board's Zobrist key if it is already known."""
+        if self.stats is not None:
+            self.stats.evaluations += 1
         total = sum(self.weights)
         normalized_weights = np.array(self.weights) / total
-        return sum(self.heuristics(board) * normalized_weights)
+        return sum(self.cached_heuristics(board, key) * normalized_weights)
+
+    def statsCounters(self):
+        """Cumulative counters the statistics of a move are measured from."""
+        cache = Player.feature_cache
+        if cache is None:
+            return {}
+        return {"cache_hits" : cache.hits, "cache_misses" : cache.misses}
+
+    def recordStats(self, stats):
+        """Fill in the statistics only this type of player knows at the end of a move."""
+        pass
+
+    def cached_heuristics(self, board, key=None):
+        """Heuristic features of the board, looked up in the shared feature cache first."""
+        cache = Player.feature_cache
+        if cache is None:
+            return self.heuristics(board)
+        if key is None:
+            key = TranspositionTable.zobrist_key(board)
+        # The features depend on the point of view and on how mobility and protects are counted.
+        key = (key, self.player, self.exact_mobility, self.protects_counts_threats)
+        features = cache.get(key)
+        if features is None:
+            features = tuple(self.heuristics(board))
+            cache.put(key, features)
+        return features
 
     def heuristics(self, board):
-        cost = self.piece_cost_heuristic(board)
-        table = self.piece_square_table_heuristic(board)
+        # Time each term only when statistics are being collected.
+        stats = self.stats
+        if stats is not None:
+            clock = time.perf_counter()
+        if self.evaluator is not None:
+            # The searched board is tracked, so the sums are already known.
+            cost, table = self.evaluator.values(self.player)
+            if Player.check_incremental:
+                expected = (self.piece_cost_heuristic(board), self.piece_square_table_heuristic(board))
+                assert (cost, table) == expected, f"Incremental values {(cost, table)} should be {expected}."
+        else:
+            cost = self.piece_cost_heuristic(board)
+            table = self.piece_square_table_heuristic(board)
+        if stats is not None:
+            clock = stats.time_term("material", clock)
         advancement = self.pawn_advancement_heuristic(board)
-        mobility = self.piece_mobility_heuristic(board)
-        threats = self.piece_threats_heuristic(board)
-        protects = self.piece_protects_heuristic(board)
+        if stats is not None:
+            clock = stats.time_term("advancement", clock)
+        # Every attack based term comes from the same pass over the pieces.
+        mobility, threats, protects = Evaluation.attack_features(board, self.player)
+        if stats is not None:
+            clock = stats.time_term("attacks", clock)
+        if self.exact_mobility:
+            mobility = Evaluation.legal_mobility(board, self.player)
+            if stats is not None:
+                clock = stats.time_term("exact_mobility", clock)
+        if self.protects_counts_threats:
+            protects = threats
 
         return [cost, table, advancement, mobility, threats, protects]
 
+    def batch_heuristics(self, boards):
+        """Heuristic features of many boards at once as an (N, 6) array,
+           computed with NumPy from the boards' bitboards."""
+        return Evaluation.batch_heuristics(boards, self.player, Player.piece_square_table,
+                                           self.protects_counts_threats)
+
+    def batch_heuristic(self, boards):
+        """Heuristic values of many boards at once."""
+        normalized_weights = np.array(self.weights) / sum(self.weights)
+        return self.batch_heuristics(boards) @ normalized_weights
+
     def piece_cost_heuristic(self, board : chess.Board):
         """Cost of pieces heuristic for the board state."""
 
@@ -224,58 +312,30 @@ class Player():
             else:
                 pawn_advancement_value -= abs(start-row)
         return pawn_advancement_value
-    def piece_mobility_heuristic(self,board : chess.Board):
+    def piece_mobility_heuristic(self,board : chess.Board, exact=None):
         """Piece Mobility Heuristic. Mobility defined as
-           number of squares the piece can move to."""
-        player_board = chess.Board(board.fen())
-        player_board.turn = self.player
-
-        opponent_board = chess.Board(board.fen())
-        opponent_board.turn = not self.player
-
-        player_moves = [x for x in player_board.legal_moves]
-        opponent_moves = [x for x in opponent_board.legal_moves]
-
-        mobility_value = len(player_moves) - len(opponent_moves)
-        return mobility_value
+           number of squares the piece can move to.
+           With exact the number of legal moves is counted instead,
+           defaults to the player's exact_mobility setting."""
+        if exact is None:
+            exact = self.exact_mobility
+        if exact:
+            return Evaluation.legal_mobility(board, self.player)
+        return Evaluation.mobility(board, self.player) - Evaluation.mobility(board, not self.player)
     def piece_threats_heuristic(self,board : chess.Board):
         """Piece Threats Heuristic. Threats defined as
-           number of pieces the piece can take."""
-        map = board.piece_map()
-        threats = 0
-        for square in map:
-            piece = board.piece_at(square)
-            piece_threats = 0
-
-            for attacked in board.attacks(square):
-                if piece.color != board.color_at(attacked):
-                    piece_threats += 1
-
-            if map[square].color == self.player:
-                threats += piece_threats
-            else:
-                threats -= piece_threats
-        return threats
+           number of squares the piece attacks that do not hold one of its own pieces."""
+        return Evaluation.attack_features(board, self.player)[1]
     def piece_protects_heuristic(self,board : chess.Board):
         """Piece Protects Heuristic. Protects defined as
            number of own pieces the piece can protect"""
-        map = board.piece_map()
-        protects = 0
-        for square in map:
-            piece = board.piece_at(square)
-            piece_protects = 0
-
-            for attacked in board.attacks(square):
-                if piece.color != board.color_at(attacked):
-                    piece_protects += 1
-
-            if map[square].color == self.player:
-                protects += piece_protects
-            else:
-                protects -= piece_protects
-        return protects
+        if self.protects_counts_threats:
+            return self.piece_threats_heuristic(board)
+        return Evaluation.attack_features(board, self.player)[2]
 class ManualPlayer(Player):
     """A Manual Player to be controlled by a human."""
+    waits_for_input = True
+
     def __init__(self):
         super().__init__()
 
@@ -302,14 +362,87 @@ class AutoCheckMatePlayer(Player):
 
 class SearchingPlayer(Player):
     """Parent class for all search related automated players."""
+    # Board the search makes its moves on, "python-chess" for a copy of the
+    # game's chess.Board or "bitboard" for a SearchBoard.SearchBoard.
+    # Set on a single player to change only that player.
+    board_backend = "python-chess"
+    BACKENDS = ("python-chess", "bitboard")
+
     def __init__(self, maxDepth, weights=None):
         super().__init__(weights)
         # The maxDepth to be searched.
         self.maxDepth = maxDepth
+        # Thread searching during the opponent's turn and the event that stops it.
+        self.ponderThread = None
+        self.stopEvent = threading.Event()
+        # The opponent reply the background search expects.
+        self.ponderMove = None
+        # How often the opponent played the expected reply.
+        self.ponderHits = 0
+        self.ponderMisses = 0
+    def startPondering(self, board):
+        """Search in a background thread until the opponent has moved."""
+        if not self.ponder or self.ponderThread is not None:
+            return
+        board = board.copy()
+        if not any(board.generate_legal_moves()):
+            return
+        self.ponderMove = self.predictReply(board)
+        self.stopEvent.clear()
+        self.ponderThread = threading.Thread(target=self.ponderSearch, args=(board,), daemon=True)
+        self.ponderThread.start()
+    def stopPondering(self, board):
+        """Stop the background search and wait for it to finish."""
+        if self.ponderThread is None:
+            return False
+        self.stopEvent.set()
+        self.ponderThread.join()
+        self.ponderThread = None
+        self.stopEvent.clear()
+        hit = self.ponderMove is not None and bool(board.move_stack) and board.peek() == self.ponderMove
+        if hit:
+            self.ponderHits += 1
+        else:
+            self.ponderMisses += 1
+        return hit
+    def predictReply(self, board):
+        """The opponent move the background search expects, None if there is no guess."""
+        return None
+    def ponderSearch(self, board):
+        """Search run by the pondering thread on the board after the player's move,
+           it should return soon after stopEvent is set."""
+        pass
+    def searchBoard(self, board):
+        """A copy of the board on the player's board backend for the search to make moves on."""
+        if self.board_backend == "bitboard":
+            return SearchBoard.SearchBoard(board)
+        if self.board_backend == "python-chess":
+            return board.copy()
+        raise ValueError(f"Unknown board backend {self.board_backend}, should be one of {', '.join(self.BACKENDS)}.")
     def nextMove(self,board):
-        if board.fen() in Player.opening_dict:
-            move = random.choice(Player.opening_dict[board.fen()])
+        if self.stats_callback is not None and self.stats is None:
+            # Collect statistics while the move is found and hand them to the callback.
+            self.stats = SearchStats.SearchStats(self, board)
+            try:
+                move = self.nextMove(board)
+                self.stats.finish(self, move)
+                self.stats_callback(self.stats)
+            finally:
+                self.stats = None
+            return move
+        move = Player.book.choice(board)
+        if move is not None:
+            move = board.uci(move)
+            print(move)
+            if self.stats is not None:
+                self.stats.book = True
+            return move
+        move = Player.endgames.best_move(board)
+        if move is not None:
+            move = board.uci(move)
             print(move)
+            if self.stats is not None:
+                self.stats.endgame_table = True
             return move
         move = self.search_for_move(board)
         print(move)
@@ -317,87 +450,454 @@ class SearchingPlayer(Player):
     def search_for_move(self, board):
         pass
 
+class SearchTimeout(Exception):
+    """Raised inside a search when its time or node budget has run out."""
+    pass
+
 class MMPlayer(SearchingPlayer):
     """Class for a minimax driven player."""
-    def __init__(self, maxDepth=3, weights= None):
+    # How many nodes are searched between checks of the clock.
+    CLOCK_INTERVAL = 64
+    # Depth at which iterative deepening stops if no other limit is reached.
+    ITERATIVE_DEPTH_LIMIT = 64
+
+    # Selective search, each part can be switched on separately to measure what it saves.
+    # Null move pruning: the side to move passes and if a search NULL_MOVE_REDUCTION
+    # moves shallower still fails high the board is not searched further.
+    null_move = False
+    NULL_MOVE_REDUCTION = 2
+    # Late move reductions: quiet moves after the first LMR_FULL_MOVES are searched
+    # LMR_REDUCTION moves less deep on boards at least LMR_DEPTH from the leaves, and
+    # searched again to full depth if the reduced search finds they might be better.
+    # Reducing by two keeps the same side moving last, reducing by one makes most
+    # reduced searches look better than they are and be searched again.
+    late_move_reductions = False
+    LMR_FULL_MOVES = 3
+    LMR_DEPTH = 3
+    LMR_REDUCTION = 2
+    # Futility pruning: close to the leaves, quiet moves are not searched if the board's
+    # value plus the margin for how many moves are left still can not reach alpha (beta for min).
+    # The margins are in heuristic units, about the largest change quiet moves made in
+    # sampled games with the default weights.
+    futility_pruning = False
+    FUTILITY_MARGINS = [0, 4, 6]
+    # Principal variation search: every move after the first is searched with a null
+    # window, which only shows it is no better than the best move so far, and searched
+    # again with the full window if it is better.
+    principal_variation_search = True
+    # Aspiration windows: iterative deepening searches the root with a window of
+    # ASPIRATION_WINDOW heuristic units either side of the previous iteration's value,
+    # widening it each time the value falls outside.
+    aspiration_windows = True
+    ASPIRATION_WINDOW = 1
+
+    def __init__(self, maxDepth=3, weights= None, hash_size=16, max_time=None, max_nodes=None):
+        if maxDepth is None and max_time is None and max_nodes is None:
+            raise ValueError("A player without a depth limit needs max_time or max_nodes.")
         super().__init__(maxDepth, weights)
+        # Transposition table of searched positions, kept between moves.
+        # hash_size is its memory cap in megabytes, 0 or None disables it.
+        self.table = TranspositionTable.TranspositionTable(hash_size) if hash_size else None
+        # Seconds and nodes each move may use. If either is set the player
+        # searches depth 1, 2, 3, ... until the budget runs out, with maxDepth
+        # as the deepest iteration (None for no depth limit).
+        self.max_time = max_time
+        self.max_nodes = max_nodes
+        # Depth of the search currently running.
+        self.searchDepth = maxDepth
+        # Number of boards visited by the current search.
+        self.nodes = 0
+        self.deadline = math.inf
+        self.nodeLimit = math.inf
+        # Principal variation of the last completed iteration.
+        self.pv = []
+        self.rootPly = 0
+        # Killer and history tables used to order the moves of each board.
+        self.orderer = MoveOrdering.MoveOrderer()
+        # Depth of the last completed search.
+        self.depthReached = 0
+        # Result of the last background search, see search.
+        self.ponderResult = None
+        # Zobrist keys of the boards on the current search path, the last is the board being searched.
+        self.keys = []
+        # How many times each position has occurred in the game and on the search path.
+        self.repetitions = {}
+        # Called after every completed iteration of iterative deepening with the depth,
+        # the value, the depth a forced result was found at, the nodes and the principal variation.
+        self.iteration_callback = None
+
+    def setPlayer(self, player):
+        # Stored values are from the point of view of the player,
+        # so they are no longer valid if the player changes.
+        if self.table is not None and player != self.player:
+            self.table.clear()
+        super().setPlayer(player)
+
     def search_for_move(self, board):
-        # Call max on the board since it is this players turn.
-        move,value,depthfound = self.maxValue(board, 0, -math.inf, math.inf)
-        return board.uci(move)
-
-    def minValue(self,board, depth, alpha, beta):
-        """Min step of minimax"""
-        # Checks for terminal state.
-        terminal = self.terminal(board)
-        # terminal[0] is a boolean indicating if the state is terminal.
-        if terminal[0]:
-            # terminal[1] is the value of the terminal state.
-            return None, terminal[1], depth
-        # Depth check.
-        if depth >= self.maxDepth:
-            # returns the heuristic value of the board.
-            return None, self.heuristic(board), depth
-        v = math.inf
-        bestMove = None
-        for move in board.legal_moves:
-            # Make the move.
+        # Continue from the background search if it searched the reply the opponent played.
+        resume = self.ponderResult if self.ponderResult is not None and self.ponderResult[0] == TranspositionTable.zobrist_key(board) else None
+        self.ponderResult = None
+        if (resume is not None and self.max_time is None and self.max_nodes is None
+                and self.maxDepth is not None and resume[2] >= self.maxDepth):
+            # Pondering already searched the board as deep as this player searches.
+            self.depthReached = resume[2]
+            return board.uci(resume[1])
+        return board.uci(self.search(board, resume=resume))
+
+    def search(self, board, resume=None, ponder=False):
+        """Find the best move of the board.
+           resume is the key, move, depth and principal variation a search of
+           the same board reached during pondering. With ponder the search only
+           stops when stopEvent is set."""
+        if self.table is not None:
+            self.table.new_search()
+        self.orderer.new_search()
+        self.nodes = 0
+        self.pv = []
+        # The game history is only needed for repetitions, the search runs on its own board.
+        self.repetitions = self.history(board)
+        board = self.searchBoard(board)
+        self.rootPly = len(board.move_stack)
+        # Track the material and piece square sums as moves are made.
+        self.evaluator = Evaluation.IncrementalEvaluator(board, Player.piece_square_table)
+        self.keys = [TranspositionTable.zobrist_key(board)]
+        try:
+            if ponder:
+                # The player's own time and node budget only applies once it is its turn.
+                return self.iterative_deepening(board, MMPlayer.ITERATIVE_DEPTH_LIMIT, budget=False)
+            if resume is not None:
+                key, move, depth, self.pv = resume
+                return self.iterative_deepening(board, first=depth + 1, best=move)
+            # With only a depth limit that depth is searched once. A player whose limits were
+            # all cleared after it was made deepens until stopEvent is set.
+            if self.max_time is None and self.max_nodes is None and self.maxDepth is not None:
+                self.searchDepth = self.maxDepth
+                # The board is this player's turn, so its values are the player's.
+                move,value,depthfound = self.negamax(board, 0, -math.inf, math.inf)
+                self.depthReached = self.searchDepth
+                return move
+            return self.iterative_deepening(board)
+        finally:
+            self.evaluator = None
+
+    def predictReply(self, board):
+        # The best reply the search found for the board after this player's move.
+        move = None
+        if self.table is not None:
+            move = self.table.best_move(TranspositionTable.zobrist_key(board))
+        if move is None and len(self.pv) > 1:
+            move = self.pv[1]
+        if move is not None and board.is_legal(move):
+            return move
+        return None
+
+    def ponderSearch(self, board):
+        """Search the board after the expected reply until the opponent has moved."""
+        self.ponderResult = None
+        if self.ponderMove is None:
+            return
+        board.push(self.ponderMove)
+        if not any(board.generate_legal_moves()):
+            return
+        move = self.search(board, ponder=True)
+        if move is not None:
+            self.ponderResult = (TranspositionTable.zobrist_key(board), move, self.depthReached, list(self.pv))
+
+    def iterative_deepening(self, board, limit=None, first=1, best=None, budget=True):
+        """Search depth first, first + 1, ... until the time or node budget runs out
+           or limit is reached. Returns the best move of the last completed iteration,
+           or best if none completed. Without budget only limit and stopEvent end the search."""
+        start = time.perf_counter()
+        if limit is None:
+            limit = self.maxDepth if self.maxDepth is not None else MMPlayer.ITERATIVE_DEPTH_LIMIT
+        value = None
+        depth = first
+        # With a move already known the budget applies from the start.
+        if best is not None and budget:
+            self.startBudget(start)
+        while depth <= limit:
+            self.searchDepth = depth
+            try:
+                move,value,depthfound = self.aspiration(board, value)
+            except SearchTimeout:
+                # Undo the moves of the search that was interrupted.
+                while len(board.move_stack) > self.rootPly:
+                    self.unmakeMove(board)
+                break
+            finally:
+                self.deadline = math.inf
+                self.nodeLimit = math.inf
+            best = move
+            self.depthReached = depth
+            self.pv = self.principal_variation(board, move, depth)
+            if self.iteration_callback is not None:
+                self.iteration_callback(depth, value, depthfound, self.nodes, self.pv)
+            # Stop once a forced result is found, deeper searches will not change it.
+            if value in (self.WINSCORE, self.LOSESCORE):
+                break
+            # The first iteration always completes so there is always a move,
+            # later iterations are stopped when the budget runs out.
+            if budget and self.startBudget(start):
+                break
+            depth += 1
+        return best
+
+    def startBudget(self, start):
+        """Limit the search to the time and nodes it has left from start.
+           Returns True if the budget is already used up."""
+        if self.max_time is not None:
+            self.deadline = start + self.max_time
+            if time.perf_counter() >= self.deadline:
+                return True
+        if self.max_nodes is not None:
+            self.nodeLimit = self.max_nodes
+            if self.nodes >= self.nodeLimit:
+                return True
+        return False
+
+    def aspiration(self, board, previous):
+        """Search the root in a window around the previous iteration's value,
+           searching again with a wider window until the value is inside it."""
+        if not self.aspiration_windows or previous is None:
+            return self.negamax(board, 0, -math.inf, math.inf)
+        width = MMPlayer.ASPIRATION_WINDOW
+        alpha = previous - width
+        beta = previous + width
+        while True:
+            move,value,depthfound = self.negamax(board, 0, alpha, beta)
+            if value <= alpha:
+                alpha = previous - width * 4 if width < 16 * MMPlayer.ASPIRATION_WINDOW else -math.inf
+            elif value >= beta:
+                beta = previous + width * 4 if width < 16 * MMPlayer.ASPIRATION_WINDOW else math.inf
+            else:
+                return move, value, depthfound
+            width *= 4
+
+    def principal_variation(self, board, move, depth):
+        """Follow the best moves in the transposition table from the root move."""
+        pv = []
+        while move is not None and len(pv) < depth and board.is_legal(move):
+            pv.append(move)
             board.push(move)
-            # Run max on the new board.
-            vprime,found = self.maxValue(board, depth + 1, alpha, beta)[1::]
-            # Undo the move.
+            move = self.table.best_move(TranspositionTable.zobrist_key(board)) if self.table is not None else None
+        for i in range(len(pv)):
             board.pop()
-            # Check if the new value is less than the previous value.
-            if vprime < v:
-                # Assign the new value to v.
-                v = vprime
-                # Assign the move as the bestMove
-                bestMove = move
-                depthfound = found
-            elif v == vprime:
-                if depthfound > found:
-                    # Assign the new value to v.
-                    v = vprime
-                    # Assign the move as the bestMove
-                    bestMove = move
-                    depthfound = found
-            beta = min(beta, v)
-            # Pruning check.
-            if alpha >= beta:
-                return bestMove, v, depthfound
-        return bestMove, v, depthfound
-
-    def maxValue(self, board, depth, alpha, beta):
-        """Max step of minimax"""
-        # Checks for terminal state.
-        terminal = self.terminal(board)
+        return pv
+
+    def statsCounters(self):
+        counters = super().statsCounters()
+        if self.table is not None:
+            counters["tt_probes"] = self.table.probes
+            counters["tt_hits"] = self.table.hits
+        return counters
+
+    def recordStats(self, stats):
+        if not stats.book and not stats.endgame_table:
+            stats.nodes = self.nodes
+            stats.depth = self.depthReached
+
+    def countNode(self):
+        """Count a visited board and stop the search if the budget is used up."""
+        self.nodes += 1
+        if self.nodes >= self.nodeLimit:
+            raise SearchTimeout()
+        if self.nodes % MMPlayer.CLOCK_INTERVAL == 0:
+            if time.perf_counter() >= self.deadline or self.stopEvent.is_set():
+                raise SearchTimeout()
+
+    def probe(self, board, depth, remaining, alpha, beta, sign):
+        """Look the board up in the transposition table, remaining is how
+           many more moves deep the board is searched and sign is -1 if the
+           window is from the opponent's point of view.
+           Returns the key, the stored best move and the stored result
+           if it can be used in place of searching the board."""
+        # The key was computed when the move to the board was made.
+        key = self.keys[-1]
+        if self.table is None:
+            return key, None, None
+        entry = self.table.probe(key)
+        if entry is None:
+            return key, None, None
+        _, stored_depth, bound, value, move, distance, _ = entry
+        bound, value = self.bound(bound, value, sign)
+        # The root always has to search for a move.
+        if depth > 0 and stored_depth >= remaining:
+            if bound == EXACT or (bound == LOWER and value >= beta) or (bound == UPPER and value <= alpha):
+                return key, move, (move, value, depth + distance)
+        return key, move, None
+
+    def store(self, key, depth, remaining, bound, value, move, depthfound):
+        """Store the result of searching a board remaining moves deep in the transposition table."""
+        if self.table is not None:
+            self.table.store(key, remaining, bound, value, move, depthfound - depth)
+
+    def history(self, board):
+        """Count how many times each position since the last capture or pawn move occurred."""
+        counts = {}
+        previous = board.copy()
+        for i in range(min(board.halfmove_clock, len(board.move_stack)) + 1):
+            if i > 0:
+                previous.pop()
+            key = TranspositionTable.zobrist_key(previous)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def makeMove(self, board, move):
+        """Make a move on the searched board."""
+        self.evaluator.push(board, move)
+        key = TranspositionTable.zobrist_key(board)
+        self.keys.append(key)
+        self.repetitions[key] = self.repetitions.get(key, 0) + 1
+
+    def unmakeMove(self, board):
+        """Undo the last move made on the searched board."""
+        key = self.keys.pop()
+        self.repetitions[key] -= 1
+        self.evaluator.pop(board)
+
+    def pvMove(self, board, depth):
+        """The move of the previous iteration's principal variation at this depth,
+           if the board was reached by following the principal variation."""
+        if depth < len(self.pv) and board.move_stack[self.rootPly:] == self.pv[:depth]:
+            return self.pv[depth]
+        return None
+
+    def orderMoves(self, board, depth, hashMove):
+        """Legal moves of the board, the best candidates first."""
+        return self.orderer.order(board, depth, hashMove)
+
+    def canNullMove(self, board, depth, remaining, inCheck):
+        """If a null move may be tried on the board.
+           Never at the root, in check, twice in a row or with only pawns
+           and a king left, where passing could be the best move (zugzwang)."""
+        if not self.null_move or depth == 0 or inCheck or remaining <= MMPlayer.NULL_MOVE_REDUCTION:
+            return False
+        if board.move_stack and not board.move_stack[-1]:
+            return False
+        pieces = board.occupied_co[board.turn] & ~board.pawns & ~board.kings
+        return bool(pieces)
+
+    def futilityMargin(self, remaining, inCheck):
+        """How much a quiet move may change the value of a board this close
+           to the leaves, or None if futility pruning does not apply."""
+        if not self.futility_pruning or inCheck or remaining >= len(MMPlayer.FUTILITY_MARGINS):
+            return None
+        return MMPlayer.FUTILITY_MARGINS[remaining]
+
+    def isQuiet(self, board, move):
+        """A move that is not a capture or a promotion, checks are found after the move is made."""
+        return not move.promotion and not board.is_capture(move)
+
+    def childValue(self, board, depth, alpha, beta, horizon):
+        """Value and depth found of the board after a move, searched with the
+           (alpha, beta) window of the side that made the move."""
+        move, value, found = self.negamax(board, depth + 1, -beta, -alpha, horizon)
+        return -value, found
+
+    def negamax(self, board, depth, alpha, beta, horizon=None):
+        """Minimax of the board with values from the point of view of the side to move,
+           the search of both players' boards in one function.
+           Values from outside the search (the heuristic, terminal values and the
+           transposition table) are from self.player's point of view and are negated
+           on the opponent's boards.
+           horizon is the depth the board's moves are searched to,
+           the search depth unless a selective search reduced it."""
+        if horizon is None:
+            horizon = self.searchDepth
+        # Number of moves left before the leaves.
+        remaining = horizon - depth
+        # 1 on this player's boards and -1 on the opponent's.
+        sign = 1 if board.turn == self.player else -1
+        self.countNode()
+        # Checks if the board has already been searched deep enough.
+        key, hashMove, stored = self.probe(board, depth, remaining, alpha, beta, sign)
+        if stored is not None:
+            return stored
+        # Boards in the endgame tables have an exact value without searching.
+        if depth > 0:
+            endgame = Player.endgames.probe(board)
+            if endgame is not None:
+                return self.endgameResult(endgame, depth, sign)
+        # The previous iteration's best line is searched first.
+        hashMove = self.pvMove(board, depth) or hashMove
+        # Depth check.
+        if remaining <= 0:
+            # Checks for terminal state, only looking for the first legal move.
+            terminal = self.terminal(board, key)
+            if terminal[0]:
+                return self.terminalResult(key, terminal[1], depth, sign)
+            # returns the heuristic value of the board.
+            v = self.heuristic(board, key)
+            self.store(key, depth, 0, EXACT, v, None, depth)
+            return None, sign * v, depth
+        moves = self.orderMoves(board, depth, hashMove)
+        # Checks for terminal state with the moves that were generated anyway.
+        terminal = self.terminal(board, key, moves)
         # terminal[0] is a boolean indicating if the state is terminal.
         if terminal[0]:
             # terminal[1] is the value of the terminal state.
-            return None, terminal[1], depth
-        # Depth check.
-        if depth >= self.maxDepth:
-            # returns the heuristic value of the board.
-            return None, self.heuristic(board), depth
+            return self.terminalResult(key, terminal[1], depth, sign)
+        selective = self.null_move or self.late_move_reductions or self.futility_pruning
+        inCheck = selective and board.is_check()
+
+        if beta < math.inf and self.canNullMove(board, depth, remaining, inCheck):
+            # Pass the move, if the opponent still can not get the value below beta there is no need to move either.
+            self.makeMove(board, chess.Move.null())
+            vprime,found = self.childValue(board, depth, math.nextafter(beta, -math.inf), beta,
+                                           horizon - MMPlayer.NULL_MOVE_REDUCTION)
+            self.unmakeMove(board)
+            if vprime >= beta:
+                self.store(key, depth, remaining, *self.bound(LOWER, beta, sign), None, found)
+                return None, beta, found
+
+        margin = self.futilityMargin(remaining, inCheck)
+        if margin is not None:
+            # Quiet moves can not get the value above alpha if the board is this far below it.
+            optimistic = sign * self.heuristic(board, key) + margin
+            if optimistic > alpha:
+                margin = None
+        reduce = self.late_move_reductions and not inCheck and remaining >= MMPlayer.LMR_DEPTH
 
         v = -math.inf
         bestMove = None
-        for move in board.legal_moves:
+        alphaOrig = alpha
+        for i, move in enumerate(moves):
+            quiet = (margin is not None or reduce) and i > 0 and self.isQuiet(board, move)
             # Make the move.
-            board.push(move)
-            # Run min on the new board.
-            vprime,found = self.minValue(board,depth +1,alpha,beta)[1::]
+            self.makeMove(board, move)
+            if quiet and board.is_check():
+                # Checks are always searched to full depth.
+                quiet = False
+            if quiet and margin is not None:
+                # Count the move at the highest value it could reach without searching it.
+                vprime,found = optimistic, depth + 1
+            else:
+                # Late quiet moves are searched less deep first,
+                # and again to full depth if they might be better.
+                reduction = MMPlayer.LMR_REDUCTION if quiet and reduce and i >= MMPlayer.LMR_FULL_MOVES else 0
+                if i == 0 or not self.principal_variation_search:
+                    if reduction:
+                        vprime,found = self.childValue(board, depth, alpha, beta, horizon - reduction)
+                    if not reduction or vprime > alpha:
+                        vprime,found = self.childValue(board, depth, alpha, beta, horizon)
+                else:
+                    # Only show the move is no better than the best so far with a null window,
+                    # it is searched with the full window again if it is.
+                    nullBeta = math.nextafter(alpha, math.inf)
+                    vprime,found = self.childValue(board, depth, alpha, nullBeta, horizon - reduction)
+                    if reduction and vprime > alpha:
+                        vprime,found = self.childValue(board, depth, alpha, nullBeta, horizon)
+                    if alpha < vprime < beta:
+                        vprime,found = self.childValue(board, depth, alpha, beta, horizon)
             # Undo the move.
-            board.pop()
+            self.unmakeMove(board)
             # Check if the new value is greater than the previous value.
-
             if vprime > v:
                 # Assign the new value to v.
                 v = vprime
                 # Assign the move as the bestMove
                 bestMove = move
                 depthfound = found
-
             elif v == vprime:
                 if depthfound > found:
                     # Assign the new value to v.
@@ -409,22 +909,66 @@ class MMPlayer(SearchingPlayer):
             alpha = max(alpha, v)
             # Pruning check.
             if alpha >= beta:
+                # Remember the move so it is tried early on other boards.
+                self.orderer.cutoff(board, move, depth, remaining)
+                if self.stats is not None:
+                    self.stats.cutoff(i == 0)
+                # The value is at least v since the opponent will not allow this board.
+                self.store(key, depth, remaining, *self.bound(LOWER, v, sign), bestMove, depthfound)
                 return bestMove, v, depthfound
+        self.store(key, depth, remaining, *self.bound(EXACT if v > alphaOrig else UPPER, v, sign), bestMove, depthfound)
         return bestMove, v, depthfound
 
-    def terminal(self, board):
-        """Return if the board is terminal and what the value is."""
-        # Termination check.
-        if board.outcome() is not None:
+    def bound(self, bound, value, sign):
+        """A bound and value from the side to move's point of view, as seen by self.player.
+           A lower bound for the opponent is an upper bound for the player."""
+        if sign < 0 and bound != EXACT:
+            bound = UPPER if bound == LOWER else LOWER
+        return bound, sign * value
+
+    def terminalResult(self, key, value, depth, sign):
+        """Store a terminal board in the transposition table and return its result
+           from the point of view of the side to move."""
+        if self.table is not None:
+            # Terminal values do not depend on how deep the board is searched.
+            self.table.store(key, math.inf, EXACT, value, None, 0)
+        return None, sign * value, depth
+
+    def endgameResult(self, endgame, depth, sign):
+        """The result of a board found in the endgame tables from the point of view of the side to move,
+           a mate is found as many moves deeper as the table says it takes."""
+        winner, plies = endgame
+        if winner is None:
+            return None, sign * self.TIESCORE, depth
+        return None, sign * (self.WINSCORE if winner == self.player else self.LOSESCORE), depth + plies
+
+    def terminal(self, board, key=None, moves=None):
+        """Return if the board is terminal and what the value is.
+           moves are the legal moves of the board if they are already known
+           and key is the board's Zobrist key if it is in the repetition table."""
+        # Checkmate and stalemate, without generating more than one move if none are known.
+        if moves is None:
+            has_moves = any(board.generate_legal_moves())
+        else:
+            has_moves = len(moves) > 0
+        if not has_moves:
             # Check if the terminal state is checkmate.
-            if board.outcome().termination == chess.Termination.CHECKMATE:
-                # Check if the player won.
-                if board.outcome().winner == self.player:
+            if board.is_check():
+                # The player to move is checkmated, check if the player won.
+                if board.turn != self.player:
                     # return that the state is terminal and the value is the win score.
                     return True, self.WINSCORE
                 # return that the state is terminal and the value is the lose score.
                 return True, self.LOSESCORE
-            # return that the state is terminal and the value is the tie score.
+            # Stalemate is a tie.
+            return True, self.TIESCORE
+        # Draws by the seventy-five move rule, insufficient material and fivefold repetition.
+        if board.halfmove_clock >= 150 or board.is_insufficient_material():
+            return True, self.TIESCORE
+        if key is not None and key in self.repetitions:
+            if self.repetitions[key] >= 5:
+                return True, self.TIESCORE
+        elif board.is_fivefold_repetition():
             return True, self.TIESCORE
         # return that the state is not terminal
         # The value only matters if it is terminal, so return a null value.
@@ -0,0 +1,526 @@
+import chess
+import chess.polyglot
+
+# Zobrist keys of each piece on each square, indexed [color][piece type][square],
+# the same keys chess.polyglot.zobrist_hash uses.
+PIECE_KEYS = [[[0] * 64] + [[chess.polyglot.POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + square]
+                              for square in chess.SQUARES]
+                             for piece_type in chess.PIECE_TYPES]
+              for color in (chess.BLACK, chess.WHITE)]
+# Zobrist keys of the castling rights of each rook corner, of the en passant file and of white to move.
+CASTLING_KEYS = {
+    chess.H1 : chess.polyglot.POLYGLOT_RANDOM_ARRAY[768],
+    chess.A1 : chess.polyglot.POLYGLOT_RANDOM_ARRAY[769],
+    chess.H8 : chess.polyglot.POLYGLOT_RANDOM_ARRAY[770],
+    chess.A8 : chess.polyglot.POLYGLOT_RANDOM_ARRAY[771],
+}
+EP_KEYS = chess.polyglot.POLYGLOT_RANDOM_ARRAY[772:780]
+TURN_KEY = chess.polyglot.POLYGLOT_RANDOM_ARRAY[780]
+
+BB_CORNERS = chess.BB_A1 | chess.BB_H1 | chess.BB_A8 | chess.BB_H8
+BB_BACKRANKS = [chess.BB_RANK_8, chess.BB_RANK_1]
+PROMOTIONS = [chess.QUEEN, chess.ROOK, chess.BISHOP, chess.KNIGHT]
+
+# Every move object is made once here, so generating moves does not allocate them.
+MOVES = [chess.Move(from_square, to_square) for from_square in chess.SQUARES for to_square in chess.SQUARES]
+PROMOTION_MOVES = {(from_square, to_square, promotion) : chess.Move(from_square, to_square, promotion)
+                   for from_square in chess.SQUARES for to_square in chess.SQUARES
+                   if chess.square_rank(to_square) in (0, 7) and abs(from_square - to_square) in (7, 8, 9)
+                   for promotion in PROMOTIONS}
+
+# Castling as (king from, king to, rook from, rook to, squares that must be empty,
+# squares the king passes that must not be attacked), indexed by color.
+CASTLINGS = [
+    [(chess.E8, chess.G8, chess.H8, chess.F8, chess.BB_F8 | chess.BB_G8, [chess.F8, chess.G8]),
+     (chess.E8, chess.C8, chess.A8, chess.D8, chess.BB_B8 | chess.BB_C8 | chess.BB_D8, [chess.D8, chess.C8])],
+    [(chess.E1, chess.G1, chess.H1, chess.F1, chess.BB_F1 | chess.BB_G1, [chess.F1, chess.G1]),
+     (chess.E1, chess.C1, chess.A1, chess.D1, chess.BB_B1 | chess.BB_C1 | chess.BB_D1, [chess.D1, chess.C1])],
+]
+# The rook move of each castling, looked up by the king's move when it is made and unmade.
+ROOK_CASTLING = {(king_from, king_to) : (rook_from, rook_to)
+                 for side in CASTLINGS for king_from, king_to, rook_from, rook_to, empty, passed in side}
+
+
+def rook_attacks(square, occupied):
+    """Squares a rook on the square attacks, using python-chess' precomputed attack tables."""
+    return (chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+            chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied])
+
+
+def bishop_attacks(square, occupied):
+    """Squares a bishop on the square attacks."""
+    return chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied]
+
+
+class SearchBoard():
+    """Board used inside the search, kept as integer bitboards and a list of piece types.
+
+    Moves are made and unmade in place, with the Zobrist key updated by the
+    difference each move makes, so the key of every searched board is known
+    without rehashing it. Only standard chess is supported.
+
+    The board has the parts of the chess.Board interface the players use,
+    so the heuristics, the incremental evaluator and move ordering work on
+    either board. Legal moves are generated as pseudo-legal moves and only
+    the moves that could leave the king in check are tested, when they are
+    reached."""
+
+    def __init__(self, board: chess.Board = None):
+        if board is None:
+            board = chess.Board()
+        # Bitboards of each piece type, indexed by chess.PieceType, and of each color.
+        self.piece_masks = [0] * 7
+        self.occupied_co = [0, 0]
+        self.occupied = 0
+        # Piece type on each square, 0 for an empty square.
+        self.types = [0] * 64
+        for square, piece in board.piece_map().items():
+            self.set_piece(square, piece.piece_type, piece.color)
+        self.turn = board.turn
+        self.castling_rights = board.clean_castling_rights() & BB_CORNERS
+        self.ep_square = board.ep_square
+        self.halfmove_clock = board.halfmove_clock
+        self.fullmove_number = board.fullmove_number
+        self.key = chess.polyglot.zobrist_hash(board)
+        self.move_stack = []
+        # What each move changed that can not be worked out again from the move itself.
+        self.stack = []
+        # Keys of the earlier boards since the last capture or pawn move, for repetitions.
+        self.keys = []
+        previous = board.copy()
+        for i in range(min(board.halfmove_clock, len(board.move_stack))):
+            previous.pop()
+            self.keys.append(chess.polyglot.zobrist_hash(previous))
+        self.keys.reverse()
+
+    # Bitboards of each piece type under the names chess.Board uses.
+    @property
+    def pawns(self):
+        return self.piece_masks[chess.PAWN]
+
+    @property
+    def knights(self):
+        return self.piece_masks[chess.KNIGHT]
+
+    @property
+    def bishops(self):
+        return self.piece_masks[chess.BISHOP]
+
+    @property
+    def rooks(self):
+        return self.piece_masks[chess.ROOK]
+
+    @property
+    def queens(self):
+        return self.piece_masks[chess.QUEEN]
+
+    @property
+    def kings(self):
+        return self.piece_masks[chess.KING]
+
+    def set_piece(self, square, piece_type, color):
+        """Put a piece on an empty square, without changing the key."""
+        mask = chess.BB_SQUARES[square]
+        self.types[square] = piece_type
+        self.piece_masks[piece_type] |= mask
+        self.occupied_co[color] |= mask
+        self.occupied |= mask
+
+    def remove_piece(self, square, color):
+        """Take the piece of the color off the square and return its type, without changing the key."""
+        mask = chess.BB_SQUARES[square]
+        piece_type = self.types[square]
+        self.types[square] = 0
+        self.piece_masks[piece_type] ^= mask
+        self.occupied_co[color] ^= mask
+        self.occupied ^= mask
+        return piece_type
+
+    def copy(self):
+        copy = SearchBoard.__new__(SearchBoard)
+        copy.piece_masks = list(self.piece_masks)
+        copy.occupied_co = list(self.occupied_co)
+        copy.occupied = self.occupied
+        copy.types = list(self.types)
+        copy.turn = self.turn
+        copy.castling_rights = self.castling_rights
+        copy.ep_square = self.ep_square
+        copy.halfmove_clock = self.halfmove_clock
+        copy.fullmove_number = self.fullmove_number
+        copy.key = self.key
+        copy.move_stack = list(self.move_stack)
+        copy.stack = list(self.stack)
+        copy.keys = list(self.keys)
+        return copy
+
+    def to_board(self):
+        """The board as a chess.Board, without the move history."""
+        board = chess.Board(None)
+        for square, piece in self.piece_map().items():
+            board.set_piece_at(square, piece)
+        board.turn = self.turn
+        board.castling_rights = self.castling_rights
+        board.ep_square = self.ep_square
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        return board
+
+    def fen(self):
+        return self.to_board().fen()
+
+    def __str__(self):
+        return str(self.to_board())
+
+    def piece_type_at(self, square):
+        return self.types[square] or None
+
+    def piece_at(self, square):
+        piece_type = self.types[square]
+        if not piece_type:
+            return None
+        return chess.Piece(piece_type, bool(self.occupied_co[chess.WHITE] & chess.BB_SQUARES[square]))
+
+    def piece_map(self, *, mask=chess.BB_ALL):
+        return {square : self.piece_at(square) for square in chess.scan_reversed(self.occupied & mask)}
+
+    def king(self, color):
+        kings = self.piece_masks[chess.KING] & self.occupied_co[color]
+        return chess.msb(kings) if kings else None
+
+    def attacks_mask(self, square):
+        """Squares the piece on the square attacks."""
+        piece_type = self.types[square]
+        if piece_type == chess.PAWN:
+            color = bool(self.occupied_co[chess.WHITE] & chess.BB_SQUARES[square])
+            return chess.BB_PAWN_ATTACKS[color][square]
+        if piece_type == chess.KNIGHT:
+            return chess.BB_KNIGHT_ATTACKS[square]
+        if piece_type == chess.KING:
+            return chess.BB_KING_ATTACKS[square]
+        attacks = 0
+        if piece_type == chess.BISHOP or piece_type == chess.QUEEN:
+            attacks = bishop_attacks(square, self.occupied)
+        if piece_type == chess.ROOK or piece_type == chess.QUEEN:
+            attacks |= rook_attacks(square, self.occupied)
+        return attacks
+
+    def attackers_mask(self, color, square, occupied):
+        """Pieces of the color attacking the square, with the sliders blocked by occupied."""
+        masks = self.piece_masks
+        queens = masks[chess.QUEEN]
+        attackers = ((chess.BB_KNIGHT_ATTACKS[square] & masks[chess.KNIGHT]) |
+                     (chess.BB_KING_ATTACKS[square] & masks[chess.KING]) |
+                     (chess.BB_PAWN_ATTACKS[not color][square] & masks[chess.PAWN]) |
+                     (rook_attacks(square, occupied) & (masks[chess.ROOK] | queens)) |
+                     (bishop_attacks(square, occupied) & (masks[chess.BISHOP] | queens)))
+        return attackers & self.occupied_co[color]
+
+    def is_attacked_by(self, color, square):
+        return bool(self.attackers_mask(color, square, self.occupied))
+
+    def checkers_mask(self):
+        king = self.king(self.turn)
+        return 0 if king is None else self.attackers_mask(not self.turn, king, self.occupied)
+
+    def is_check(self):
+        return bool(self.checkers_mask())
+
+    def pinned_mask(self, color, king):
+        """Pieces of the color that are the only piece between the king and an enemy slider."""
+        enemy = self.occupied_co[not color]
+        masks = self.piece_masks
+        snipers = ((rook_attacks(king, 0) & (masks[chess.ROOK] | masks[chess.QUEEN])) |
+                   (bishop_attacks(king, 0) & (masks[chess.BISHOP] | masks[chess.QUEEN]))) & enemy
+        pinned = 0
+        for sniper in chess.scan_forward(snipers):
+            blockers = chess.between(king, sniper) & self.occupied
+            if blockers and not blockers & (blockers - 1):
+                pinned |= blockers
+        return pinned & self.occupied_co[color]
+
+    def ep_key(self):
+        """Key of the en passant square, only hashed if a pawn could capture on it."""
+        if self.ep_square is None:
+            return 0
+        capturers = chess.BB_PAWN_ATTACKS[not self.turn][self.ep_square]
+        if capturers & self.piece_masks[chess.PAWN] & self.occupied_co[self.turn]:
+            return EP_KEYS[self.ep_square & 7]
+        return 0
+
+    def castling_key(self):
+        key = 0
+        for square in chess.scan_forward(self.castling_rights):
+            key ^= CASTLING_KEYS[square]
+        return key
+
+    def generate_pseudo_legal_moves(self):
+        """Moves of the side to move that follow the piece rules, they may leave the king in check."""
+        color = self.turn
+        own = self.occupied_co[color]
+        enemy = self.occupied_co[not color]
+        occupied = self.occupied
+        types = self.types
+        targets = ~own & chess.BB_ALL
+
+        for from_square in chess.scan_reversed(own & ~self.piece_masks[chess.PAWN]):
+            piece_type = types[from_square]
+            if piece_type == chess.KNIGHT:
+                attacks = chess.BB_KNIGHT_ATTACKS[from_square]
+            elif piece_type == chess.KING:
+                attacks = chess.BB_KING_ATTACKS[from_square]
+            elif piece_type == chess.BISHOP:
+                attacks = bishop_attacks(from_square, occupied)
+            elif piece_type == chess.ROOK:
+                attacks = rook_attacks(from_square, occupied)
+            else:
+                attacks = bishop_attacks(from_square, occupied) | rook_attacks(from_square, occupied)
+            base = from_square * 64
+            for to_square in chess.scan_reversed(attacks & targets):
+                yield MOVES[base + to_square]
+
+        # Castling, the king must not be in check or pass an attacked square.
+        rights = self.castling_rights & BB_BACKRANKS[color]
+        if rights:
+            for king_from, king_to, rook_from, rook_to, empty, passed in CASTLINGS[color]:
+                if (rights & chess.BB_SQUARES[rook_from] and not occupied & empty and
+                        not self.is_attacked_by(not color, king_from) and
+                        not any(self.is_attacked_by(not color, square) for square in passed)):
+                    yield MOVES[king_from * 64 + king_to]
+
+        pawns = self.piece_masks[chess.PAWN] & own
+        if not pawns:
+            return
+        # Pawn captures, including en passant.
+        capturable = enemy
+        if self.ep_square is not None:
+            capturable |= chess.BB_SQUARES[self.ep_square]
+        for from_square in chess.scan_reversed(pawns):
+            for to_square in chess.scan_reversed(chess.BB_PAWN_ATTACKS[color][from_square] & capturable):
+                if chess.BB_SQUARES[to_square] & chess.BB_BACKRANKS:
+                    for promotion in PROMOTIONS:
+                        yield PROMOTION_MOVES[from_square, to_square, promotion]
+                else:
+                    yield MOVES[from_square * 64 + to_square]
+
+        # Pawn pushes, one square and two from the starting rank.
+        empty = ~occupied & chess.BB_ALL
+        if color == chess.WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & chess.BB_RANK_3) << 8) & empty
+            step = 8
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & chess.BB_RANK_6) >> 8) & empty
+            step = -8
+        for to_square in chess.scan_reversed(single):
+            from_square = to_square - step
+            if chess.BB_SQUARES[to_square] & chess.BB_BACKRANKS:
+                for promotion in PROMOTIONS:
+                    yield PROMOTION_MOVES[from_square, to_square, promotion]
+            else:
+                yield MOVES[from_square * 64 + to_square]
+        for to_square in chess.scan_reversed(double):
+            yield MOVES[(to_square - 2 * step) * 64 + to_square]
+
+    def generate_legal_moves(self):
+        """Legal moves of the side to move, generated lazily.
+
+        Most moves can not leave the king in check: moves of pieces that are
+        not pinned while the king is not in check. Only king moves, en passant,
+        moves of pinned pieces and check evasions are tested."""
+        color = self.turn
+        king = self.king(color)
+        if king is None:
+            yield from self.generate_pseudo_legal_moves()
+            return
+        checkers = self.attackers_mask(not color, king, self.occupied)
+        pinned = self.pinned_mask(color, king)
+        if checkers:
+            checker = chess.msb(checkers)
+            # With one checker the check can be blocked or the checker captured,
+            # with two only the king can move.
+            evasions = chess.between(king, checker) | checkers if not checkers & (checkers - 1) else 0
+        types = self.types
+        for move in self.generate_pseudo_legal_moves():
+            from_square = move.from_square
+            to_square = move.to_square
+            if from_square == king:
+                if checkers and abs(to_square - from_square) == 2:
+                    continue
+                # The king's own square is removed so sliders see through it.
+                occupied = self.occupied ^ chess.BB_SQUARES[king]
+                if not self.attackers_mask(not color, to_square, occupied):
+                    yield move
+            elif types[from_square] == chess.PAWN and to_square == self.ep_square:
+                if self.ep_is_legal(move, king):
+                    yield move
+            else:
+                if checkers and not evasions & chess.BB_SQUARES[to_square]:
+                    continue
+                if pinned & chess.BB_SQUARES[from_square] and not chess.ray(king, from_square) & chess.BB_SQUARES[to_square]:
+                    continue
+                yield move
+
+    def ep_is_legal(self, move, king):
+        """En passant removes two pieces from a line, so the king is checked with the move made."""
+        color = self.turn
+        captured = move.to_square - 8 if color == chess.WHITE else move.to_square + 8
+        occupied = (self.occupied ^ chess.BB_SQUARES[move.from_square] ^ chess.BB_SQUARES[captured]
+                    | chess.BB_SQUARES[move.to_square])
+        masks = self.piece_masks
+        enemy = self.occupied_co[not color] & ~chess.BB_SQUARES[captured]
+        queens = masks[chess.QUEEN]
+        attackers = ((rook_attacks(king, occupied) & (masks[chess.ROOK] | queens)) |
+                     (bishop_attacks(king, occupied) & (masks[chess.BISHOP] | queens)) |
+                     (chess.BB_KNIGHT_ATTACKS[king] & masks[chess.KNIGHT]) |
+                     (chess.BB_PAWN_ATTACKS[color][king] & masks[chess.PAWN] & ~chess.BB_SQUARES[captured]))
+        return not attackers & enemy
+
+    @property
+    def legal_moves(self):
+        return list(self.generate_legal_moves())
+
+    def is_legal(self, move):
+        return any(move == legal for legal in self.generate_legal_moves())
+
+    def is_capture(self, move):
+        return bool(chess.BB_SQUARES[move.to_square] & self.occupied_co[not self.turn]) or self.is_en_passant(move)
+
+    def is_en_passant(self, move):
+        return (move.to_square == self.ep_square and self.types[move.from_square] == chess.PAWN and
+                abs(move.to_square - move.from_square) in (7, 9) and
+                not self.occupied & chess.BB_SQUARES[move.to_square])
+
+    def is_castling(self, move):
+        return self.types[move.from_square] == chess.KING and abs(move.to_square - move.from_square) == 2
+
+    def is_kingside_castling(self, move):
+        return self.is_castling(move) and move.to_square > move.from_square
+
+    def uci(self, move):
+        return move.uci()
+
+    def push(self, move):
+        """Make the move in place, updating the key by what the move changes."""
+        color = self.turn
+        key = self.key ^ self.ep_key() ^ TURN_KEY
+        captured = 0
+        captured_square = None
+        # What is needed to unmake the move, with the captured piece filled in below.
+        state = [self.castling_rights, self.ep_square, self.halfmove_clock, self.key]
+        self.keys.append(self.key)
+        self.move_stack.append(move)
+        self.halfmove_clock += 1
+        if color == chess.BLACK:
+            self.fullmove_number += 1
+
+        if move:
+            from_square = move.from_square
+            to_square = move.to_square
+            piece_type = self.remove_piece(from_square, color)
+            key ^= PIECE_KEYS[color][piece_type][from_square]
+            captured = self.types[to_square]
+            captured_square = to_square
+            if piece_type == chess.PAWN:
+                self.halfmove_clock = 0
+                # A diagonal pawn move to an empty square is en passant.
+                if not captured and to_square == self.ep_square and (to_square - from_square) & 1:
+                    captured_square = to_square - 8 if color == chess.WHITE else to_square + 8
+                    captured = chess.PAWN
+            if captured:
+                self.remove_piece(captured_square, not color)
+                key ^= PIECE_KEYS[not color][captured][captured_square]
+                self.halfmove_clock = 0
+            placed = move.promotion or piece_type
+            self.set_piece(to_square, placed, color)
+            key ^= PIECE_KEYS[color][placed][to_square]
+
+            if piece_type == chess.KING and abs(to_square - from_square) == 2:
+                rook_from, rook_to = ROOK_CASTLING[from_square, to_square]
+                self.remove_piece(rook_from, color)
+                self.set_piece(rook_to, chess.ROOK, color)
+                key ^= PIECE_KEYS[color][chess.ROOK][rook_from] ^ PIECE_KEYS[color][chess.ROOK][rook_to]
+
+            # Moving the king or moving from or to a rook corner loses castling rights.
+            if self.castling_rights:
+                rights = self.castling_rights & ~chess.BB_SQUARES[from_square] & ~chess.BB_SQUARES[to_square]
+                if piece_type == chess.KING:
+                    rights &= ~BB_BACKRANKS[color]
+                if rights != self.castling_rights:
+                    key ^= self.castling_key()
+                    self.castling_rights = rights
+                    key ^= self.castling_key()
+
+            double_push = piece_type == chess.PAWN and abs(to_square - from_square) == 16
+            self.ep_square = (from_square + to_square) // 2 if double_push else None
+        else:
+            self.ep_square = None
+
+        self.stack.append((captured, captured_square, *state))
+        self.turn = not color
+        self.key = key ^ self.ep_key()
+
+    def pop(self):
+        """Unmake the last move and return it."""
+        move = self.move_stack.pop()
+        captured, captured_square, self.castling_rights, self.ep_square, self.halfmove_clock, self.key = self.stack.pop()
+        self.keys.pop()
+        self.turn = color = not self.turn
+        if color == chess.BLACK:
+            self.fullmove_number -= 1
+        if move:
+            from_square = move.from_square
+            to_square = move.to_square
+            piece_type = self.remove_piece(to_square, color)
+            if move.promotion:
+                piece_type = chess.PAWN
+            self.set_piece(from_square, piece_type, color)
+            if captured:
+                self.set_piece(captured_square, captured, not color)
+            if piece_type == chess.KING and abs(to_square - from_square) == 2:
+                rook_from, rook_to = ROOK_CASTLING[from_square, to_square]
+                self.remove_piece(rook_to, color)
+                self.set_piece(rook_from, chess.ROOK, color)
+        return move
+
+    def is_repetition(self, count=3):
+        """True if the board occurred count times since the last capture or pawn move."""
+        recent = self.keys[len(self.keys) - self.halfmove_clock:] if self.halfmove_clock else []
+        return recent.count(self.key) + 1 >= count
+
+    def is_fivefold_repetition(self):
+        return self.is_repetition(5)
+
+    def has_insufficient_material(self, color):
+        """The same rules as chess.Board.has_insufficient_material."""
+        own = self.occupied_co[color]
+        masks = self.piece_masks
+        if own & (masks[chess.PAWN] | masks[chess.ROOK] | masks[chess.QUEEN]):
+            return False
+        if own & masks[chess.KNIGHT]:
+            return (chess.popcount(own) <= 2 and
+                    not self.occupied_co[not color] & ~masks[chess.KING] & ~masks[chess.QUEEN])
+        if own & masks[chess.BISHOP]:
+            bishops = masks[chess.BISHOP]
+            same_color = not bishops & chess.BB_DARK_SQUARES or not bishops & chess.BB_LIGHT_SQUARES
+            return same_color and not masks[chess.PAWN] and not masks[chess.KNIGHT]
+        return True
+
+    def is_insufficient_material(self):
+        return self.has_insufficient_material(chess.WHITE) and self.has_insufficient_material(chess.BLACK)
+
+    def outcome(self):
+        """The outcome of the game or None, checked in the same order as chess.Board.outcome."""
+        if not any(self.generate_legal_moves()):
+            if self.is_check():
+                return chess.Outcome(chess.Termination.CHECKMATE, not self.turn)
+            if self.is_insufficient_material():
+                return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+            return chess.Outcome(chess.Termination.STALEMATE, None)
+        if self.is_insufficient_material():
+            return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+        if self.halfmove_clock >= 150:
+            return chess.Outcome(chess.Termination.SEVENTYFIVE_MOVES, None)
+        if self.is_fivefold_repetition():
+            return chess.Outcome(chess.Termination.FIVEFOLD_REPETITION, None)
+        return None
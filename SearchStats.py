@@ -0,0 +1,123 @@
+import json
+import time
+
+# Counters that are added together when statistics are aggregated.
+COUNTERS = ["moves", "nodes", "evaluations", "cutoffs", "first_move_cutoffs", "tt_probes", "tt_hits",
+            "cache_hits", "cache_misses", "iterations", "tree_size", "time"]
+
+
+class SearchStats():
+    """Statistics of the search for a single move.
+
+    Players only fill these in while their stats_callback is set, so a
+    player without a callback pays nothing more than a check for None."""
+
+    def __init__(self, player, board):
+        self.player = "white" if player.player else "black"
+        self.ply = len(board.move_stack)
+        self.move = None
+        # True if the move came from the opening book without a search.
+        self.book = False
+        # True if the move came from the endgame tables without a search.
+        self.endgame_table = False
+        self.nodes = 0
+        self.evaluations = 0
+        self.cutoffs = 0
+        # Cutoffs caused by the first move searched at a board.
+        self.first_move_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.iterations = 0
+        self.tree_size = 0
+        self.depth = 0
+        # Seconds spent computing each heuristic term.
+        self.heuristic_time = {}
+        self.time = 0
+        # Cumulative counters of the player when the search started.
+        self.start_counters = player.statsCounters()
+        self.start_time = time.perf_counter()
+
+    def cutoff(self, first):
+        """Count a beta cutoff, first is True if the first move searched caused it."""
+        self.cutoffs += 1
+        if first:
+            self.first_move_cutoffs += 1
+
+    def time_term(self, name, since):
+        """Add the time since the given perf_counter reading to a heuristic term.
+           Returns the current reading so the next term can be timed from it."""
+        now = time.perf_counter()
+        self.heuristic_time[name] = self.heuristic_time.get(name, 0) + now - since
+        return now
+
+    def finish(self, player, move):
+        """Record the move and the counters that changed during the search."""
+        self.time = time.perf_counter() - self.start_time
+        self.move = move
+        for name, value in player.statsCounters().items():
+            setattr(self, name, getattr(self, name) + value - self.start_counters.get(name, 0))
+        player.recordStats(self)
+
+    def to_dict(self):
+        """The statistics as a dictionary that can be written as JSON."""
+        values = {
+            "player" : self.player,
+            "ply" : self.ply,
+            "move" : str(self.move),
+            "book" : self.book,
+            "endgame_table" : self.endgame_table,
+            "depth" : self.depth,
+            "heuristic_time" : dict(self.heuristic_time),
+        }
+        for name in COUNTERS:
+            if name != "moves":
+                values[name] = getattr(self, name)
+        values.update(rates(values))
+        return values
+
+
+def rates(values):
+    """Hit and cutoff rates of a dictionary of counters."""
+    def ratio(part, whole):
+        return values[part] / values[whole] if values[whole] else 0
+    return {
+        "first_move_cutoff_rate" : ratio("first_move_cutoffs", "cutoffs"),
+        "tt_hit_rate" : ratio("tt_hits", "tt_probes"),
+        "cache_hit_rate" : values["cache_hits"] / (values["cache_hits"] + values["cache_misses"])
+                           if values["cache_hits"] + values["cache_misses"] else 0,
+        "nodes_per_second" : ratio("nodes", "time"),
+    }
+
+
+def summarize(records):
+    """Aggregate statistics of single moves, or earlier summaries, into one summary."""
+    summary = {name : 0 for name in COUNTERS}
+    summary["depth"] = 0
+    summary["heuristic_time"] = {}
+    for record in records:
+        for name in COUNTERS:
+            # A single move counts as one move, a summary knows how many it covers.
+            summary[name] += record.get(name, 1 if name == "moves" else 0)
+        summary["depth"] = max(summary["depth"], record.get("depth", 0))
+        for term, seconds in record.get("heuristic_time", {}).items():
+            summary["heuristic_time"][term] = summary["heuristic_time"].get(term, 0) + seconds
+    summary.update(rates(summary))
+    return summary
+
+
+class JsonLinesSink():
+    """Writes each statistics record it is called with as one line of JSON."""
+
+    def __init__(self, path):
+        self.file = open(path, "a")
+
+    def __call__(self, record):
+        if isinstance(record, SearchStats):
+            record = record.to_dict()
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -1,5 +1,29 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+
 import Player
+import ChessGame
+import SearchStats
+import GeneticAlgorithm
+import MCTS
+import MoveOrdering
+import ParallelMCTS
+import SearchBoard
+import Evaluation
+import Benchmark
+import Tuner
+import GameStore
+import Match
+import EndgameTables
+import UCI
 import chess
+import chess.polyglot
+import numpy as np
 
 if __name__ == "__main__":
     boards = ["rnbqkbnr/pppp1ppp/4p3/8/6P1/5P2/PPPPP2P/RNBQKBNR b KQkq - 0 2",
@@ -18,6 +42,8 @@ if __name__ == "__main__":
     passed += 1
 
     assert mobility == 2, f"Mobility value is {mobility}, should be 2"
+    exact_mobility = player.piece_mobility_heuristic(chess.Board(boards[1]), exact=True)
+    assert exact_mobility == 2, f"Exact mobility value is {exact_mobility}, should be 2"
     passed += 1
 
     assert threats == 2, f"Threats value is {threats}, should be 2."
@@ -28,4 +54,389 @@ if __name__ == "__main__":
         return
     passed += 1
 
+    # Protects counts the attacked squares holding the side's own pieces, and with
+    # protects_counts_threats it is the copy of threats earlier weights were tuned with.
+    protects_board = chess.Board("4k3/8/8/8/8/8/3PP3/3QK3 w - - 0 1")
+    protects_player = Player.MMPlayer()
+    protects_player.setPlayer(chess.WHITE)
+    assert protects_player.protects_counts_threats, "The default weights were tuned with protects counting threats."
+    protects_player.protects_counts_threats = False
+    features = protects_player.heuristics(protects_board)
+    assert features[4:] == [7, 6], f"Threats and protects are {features[4:]}, should be [7, 6]."
+    assert protects_player.batch_heuristics([protects_board])[0, 5] == 6
+    protects_player.protects_counts_threats = True
+    features = protects_player.heuristics(protects_board)
+    assert features[4:] == [7, 7], f"Threats and protects counted as threats are {features[4:]}, should be [7, 7]."
+    assert protects_player.piece_protects_heuristic(protects_board) == 7
+    assert protects_player.batch_heuristics([protects_board])[0, 5] == 7
+    passed += 1
+
+    # Moves are ordered hash move first, then captures by MVV-LVA, then killers and then history scores.
+    ordering_board = chess.Board("4k3/8/8/3q4/4P3/8/3p4/3Q3K w - - 0 1")
+    orderer = MoveOrdering.MoveOrderer()
+    quiet = [move for move in ordering_board.legal_moves if not ordering_board.is_capture(move)]
+    ordered = orderer.order(ordering_board, 0, hash_move=quiet[-1])
+    assert ordered[0] == quiet[-1], f"First move is {ordered[0]}, should be the hash move {quiet[-1]}."
+    assert ordered[1:3] == [chess.Move.from_uci("e4d5"), chess.Move.from_uci("d1d2")], f"Captures are ordered {ordered[1:3]}."
+    # A deep cutoff at ply 1 gives quiet[1] the higher history score, the killer of ply 0 still comes first there.
+    orderer.cutoff(ordering_board, quiet[0], 0, 1)
+    orderer.cutoff(ordering_board, quiet[1], 1, 5)
+    ordered = orderer.order(ordering_board, 0)
+    assert ordered[2:4] == [quiet[0], quiet[1]], f"Quiet moves at ply 0 start {ordered[2:4]}, should be {quiet[:2]}."
+    ordered = orderer.order(ordering_board, 2)
+    assert ordered[2:4] == [quiet[1], quiet[0]], f"Quiet moves at ply 2 start {ordered[2:4]}, should be {quiet[1::-1]}."
+    passed += 1
+
+    # The feature cache evicts the least recently used entry once it is full and counts its lookups.
+    cache = Evaluation.FeatureCache(maxsize=3)
+    for key in range(3):
+        cache.put(key, (key,))
+    assert cache.get(0) == (0,)
+    cache.put(3, (3,))
+    assert cache.get(1) is None, "The least recently used key 1 should have been evicted."
+    assert [cache.get(key) for key in (0, 2, 3)] == [(0,), (2,), (3,)]
+    assert (cache.hits, cache.misses, cache.evictions, len(cache)) == (4, 1, 1, 3), \
+        f"Hits, misses, evictions and size are {(cache.hits, cache.misses, cache.evictions, len(cache))}."
+    assert cache.hit_rate() == 0.8
+    cache.clear()
+    assert (cache.hits, cache.misses, len(cache)) == (0, 0, 0)
+    passed += 1
+
+    # The transposition table must not change the move that is found.
+    mate_board = "1k6/4R3/8/2Q5/8/8/8/1K6 w - - 0 2"
+    plain = Player.MMPlayer(3, hash_size=0)
+    plain.setPlayer(chess.WHITE)
+    hashed = Player.MMPlayer(3)
+    hashed.setPlayer(chess.WHITE)
+    plain_move = plain.search_for_move(chess.Board(mate_board))
+    hashed_move = hashed.search_for_move(chess.Board(mate_board))
+    assert plain_move == hashed_move, f"Move with table is {hashed_move}, should be {plain_move}."
+    passed += 1
+
+    # Iterative deepening stays within its node budget and leaves the board unchanged.
+    deepening = Player.MMPlayer(None, max_nodes=500)
+    deepening.setPlayer(chess.BLACK)
+    deepening_board = chess.Board(boards[0])
+    deepening.search_for_move(deepening_board)
+    assert deepening.nodes <= 500, f"Searched {deepening.nodes} nodes, should be at most 500."
+    assert deepening_board.fen() == boards[0], "Board was changed by the search."
+    passed += 1
+
+    # A player needs a depth, time or node limit, and one whose limits are cleared deepens until stopped.
+    try:
+        Player.MMPlayer(None)
+        assert False, "A player without limits should not be made."
+    except ValueError:
+        pass
+    unlimited = Player.MMPlayer(None, max_nodes=1)
+    unlimited.max_nodes = None
+    unlimited.setPlayer(chess.BLACK)
+    threading.Timer(0.3, unlimited.stopEvent.set).start()
+    unlimited_move = unlimited.search(chess.Board(boards[0]))
+    assert chess.Board(boards[0]).is_legal(unlimited_move), f"Move {unlimited_move} is not legal."
+    passed += 1
+
+    # The incrementally updated material and piece square sums match a full recount,
+    # on a board with castling, en passant and promotions available.
+    Player.Player.check_incremental = True
+    incremental = Player.MMPlayer(2, hash_size=0)
+    incremental.setPlayer(chess.WHITE)
+    incremental.search_for_move(chess.Board("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"))
+    incremental.search_for_move(chess.Board("rnbqkb1r/pp1p1pPp/8/2p1pP2/1P1P4/3P3P/P1P1P3/RNBQKBNR w KQkq e6 0 1"))
+    Player.Player.check_incremental = False
+    passed += 1
+
+    # Batched features agree with the features of each board computed on its own.
+    batch_boards = [chess.Board(fen) for fen in boards]
+    batch = player.batch_heuristics(batch_boards)
+    single = np.array([player.heuristics(board) for board in batch_boards], dtype=float)
+    assert batch.shape == (2, 6), f"Batch shape is {batch.shape}, should be (2, 6)."
+    assert (batch == single).all(), f"Batch features are {batch}, should be {single}."
+    passed += 1
+
+    # The cheap terminal check agrees with board.outcome() on finished and unfinished games.
+    terminal_player = Player.MMPlayer()
+    terminal_player.setPlayer(chess.WHITE)
+    for fen in ["7k/5Q2/6K1/8/8/8/8/8 b - - 0 1", "6Qk/8/6K1/8/8/8/8/8 b - - 0 1",
+                "8/8/4k3/8/8/4K3/8/8 w - - 0 1", boards[0]]:
+        terminal_board = chess.Board(fen)
+        terminal = terminal_player.terminal(terminal_board)
+        assert terminal[0] == (terminal_board.outcome() is not None), f"Terminal of {fen} is {terminal}."
+    passed += 1
+
+    # The bitboard search board generates the same moves as python-chess and
+    # keeps its Zobrist key equal to the polyglot hash, and searching on it finds the same move.
+    kiwipete = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"
+    search_board = SearchBoard.SearchBoard(chess.Board(kiwipete))
+    nodes = Benchmark.perft(search_board, 2)
+    assert nodes == 2039, f"Perft of kiwipete to depth 2 is {nodes}, should be 2039."
+    assert search_board.fen() == kiwipete, f"Board is {search_board.fen()} after perft, should be {kiwipete}."
+    # The quick benchmark checks its node counts on both backends too.
+    Benchmark.bench_perft(quick=True)
+    for move in search_board.legal_moves:
+        search_board.push(move)
+        expected = chess.polyglot.zobrist_hash(search_board.to_board())
+        assert search_board.key == expected, f"Key after {move} is {search_board.key}, should be {expected}."
+        search_board.pop()
+    bitboard = Player.MMPlayer(3)
+    bitboard.board_backend = "bitboard"
+    bitboard.setPlayer(chess.WHITE)
+    bitboard_move = bitboard.search_for_move(chess.Board(mate_board))
+    assert bitboard_move == plain_move, f"Move on the bitboard is {bitboard_move}, should be {plain_move}."
+    passed += 1
+
+    # The selective search finds the same mate with fewer nodes.
+    selective = Player.MMPlayer(4)
+    selective.null_move = selective.late_move_reductions = selective.futility_pruning = True
+    selective.setPlayer(chess.WHITE)
+    full = Player.MMPlayer(4)
+    full.setPlayer(chess.WHITE)
+    selective_move = selective.search_for_move(chess.Board(mate_board))
+    full_move = full.search_for_move(chess.Board(mate_board))
+    assert selective_move == full_move, f"Selective search move is {selective_move}, should be {full_move}."
+    assert selective.nodes < full.nodes, f"Selective search used {selective.nodes} nodes, full search {full.nodes}."
+    passed += 1
+
+    # Principal variation search with aspiration windows finds the move plain alpha-beta does.
+    alpha_beta = Player.MMPlayer(3, max_nodes=10 ** 6)
+    alpha_beta.principal_variation_search = alpha_beta.aspiration_windows = False
+    alpha_beta.setPlayer(chess.WHITE)
+    pvs = Player.MMPlayer(3, max_nodes=10 ** 6)
+    pvs.setPlayer(chess.WHITE)
+    alpha_beta_move = alpha_beta.search_for_move(chess.Board(kiwipete))
+    pvs_move = pvs.search_for_move(chess.Board(kiwipete))
+    assert pvs_move == alpha_beta_move, f"Principal variation search move is {pvs_move}, should be {alpha_beta_move}."
+    passed += 1
+
+    # Pondering searches the expected reply in the background and the search after it reuses the result.
+    pondering = Player.MMPlayer(2)
+    pondering.ponder = True
+    pondering.setPlayer(chess.BLACK)
+    ponder_board = chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+    ponder_board.push_uci(pondering.search_for_move(ponder_board))
+    pondering.startPondering(ponder_board)
+    time.sleep(1)
+    ponder_board.push(pondering.ponderMove)
+    assert pondering.stopPondering(ponder_board), "The expected reply was played, pondering should hit."
+    pondering.search_for_move(ponder_board)
+    assert pondering.depthReached > 2, f"Depth after pondering is {pondering.depthReached}, should be more than 2."
+    passed += 1
+
+    # A player with a time budget keeps pondering after its budget has passed.
+    timed = Player.MMPlayer(None, max_time=0.2)
+    timed.ponder = True
+    timed.setPlayer(chess.BLACK)
+    timed_board = chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+    timed_board.push_uci(timed.search_for_move(timed_board))
+    timed.startPondering(timed_board)
+    time.sleep(1)
+    assert timed.ponderThread.is_alive(), "Pondering stopped at the player's time budget."
+    timed_board.push(timed.ponderMove)
+    timed.stopPondering(timed_board)
+    passed += 1
+
+    # The tuner fits weights that predict the results better than the weights it starts from.
+    rng = np.random.default_rng(0)
+    tuning_features = rng.normal(0, 3, (2000, 6))
+    tuning_results = (rng.random(2000) < Tuner.sigmoid(tuning_features @ np.array([2, 0, 0, 1, 0, 0.5]) / 3.5)).astype(float)
+    tuner = Tuner.Tuner(results=tuning_results, matrix=tuning_features, seed=0)
+    tuned, start_loss, tuned_loss = tuner.fit(epochs=50, batch_size=256)
+    assert tuned_loss < start_loss, f"Tuned loss is {tuned_loss}, should be below {start_loss}."
+    assert tuned.shape == (6,) and (tuned >= 0).all(), f"Tuned weights are {tuned}."
+    Player.MMPlayer(1, weights=tuned)
+    passed += 1
+
+    # Games written to a store come back the same, and their exported positions match the boards.
+    with tempfile.TemporaryDirectory() as directory:
+        stored = chess.Board()
+        for san in ["f3", "e6", "g4", "Qh4#"]:
+            stored.push_san(san)
+        promoting = chess.Board("8/P6k/8/8/8/8/8/K7 w - - 0 1")
+        promoting.push_uci("a7a8q")
+        store = GameStore.GameStore(os.path.join(directory, "games.bin"))
+        store.append(stored)
+        store.append(promoting, chess.WHITE, adjudicated=True)
+        store.close()
+        games = list(store.games())
+        assert games[0] == (chess.STARTING_FEN, stored.move_stack, GameStore.BLACK_WIN, False), f"Stored game is {games[0]}."
+        assert games[1][1:] == ([chess.Move.from_uci("a7a8q")], GameStore.WHITE_WIN, True), f"Stored game is {games[1]}."
+        count = GameStore.export(store, os.path.join(directory, "games"), skip=0)
+        rows, features, labels, numbers = GameStore.load(os.path.join(directory, "games"))
+        assert count == len(rows) == 5 and list(labels) == [0, 0, 0, 0, 1], f"Labels are {list(labels)}."
+        assert GameStore.unpack(rows[-1]).fen() == promoting.fen(), f"Unpacked board is {GameStore.unpack(rows[-1]).fen()}."
+        assert np.allclose(features[-1], Tuner.features([promoting])[0]), f"Exported features are {features[-1]}."
+        del rows, features, labels, numbers
+    passed += 1
+
+    # The match statistics turn scores into Elo and the test decides clear results.
+    assert abs(Match.elo(Match.expected_score(100)) - 100) < 1e-9, "Elo of the expected score of 100 Elo is not 100."
+    difference, lower, upper = Match.elo_interval(60, 20, 20)
+    assert lower < difference < upper and difference > 0, f"Elo interval is {(lower, difference, upper)}."
+    assert Match.sprt_llr(0, 0, 40, 0, 50) <= Match.sprt_bounds(0.05, 0.05)[0], "Only losses should accept H0."
+    assert Match.sprt_llr(40, 0, 0, 0, 50) >= Match.sprt_bounds(0.05, 0.05)[1], "Only wins should accept H1."
+    match = Match.Match({"args" : {"maxDepth" : 1}}, {"args" : {"maxDepth" : 1}}, games=2, workers=1, seed=0, game_time=2)
+    match_summary = match.run()
+    assert match_summary["games"] == 2, f"Match summary is {match_summary}."
+    passed += 1
+
+    # Generated endgame tables give the distance to mate, and a search that probes them plays the fastest mate.
+    with tempfile.TemporaryDirectory() as directory:
+        EndgameTables.build(["KQK", "KRK"], directory)
+        tables = EndgameTables.EndgameTables(directory)
+        rook_ending = chess.Board("8/8/8/8/8/2k5/7r/K7 b - - 0 1")
+        winner, plies = tables.probe(rook_ending)
+        while not rook_ending.is_game_over():
+            rook_ending.push(tables.best_move(rook_ending))
+        assert winner == chess.BLACK and rook_ending.is_checkmate() and len(rook_ending.move_stack) == plies, \
+            f"Mate in {plies} plies took {len(rook_ending.move_stack)}."
+        default_tables = Player.Player.endgames
+        Player.Player.endgames = tables
+        try:
+            queen_ending = chess.Board("8/8/8/3k4/8/8/8/K5Q1 w - - 0 1")
+            endgame_player = Player.MMPlayer(2)
+            endgame_player.setPlayer(chess.WHITE)
+            endgame_move = chess.Move.from_uci(endgame_player.search_for_move(queen_ending))
+            queen_ending.push(endgame_move)
+            assert tables.probe(queen_ending)[1] == tables.probe(chess.Board("8/8/8/3k4/8/8/8/K5Q1 w - - 0 1"))[1] - 1, \
+                f"{endgame_move} does not mate fastest."
+            # Parallel rollouts score the ending from the tables as the serial search does.
+            endgame_tree = MCTS.MCTSPlayer()
+            endgame_tree.setPlayer(chess.WHITE)
+            assert endgame_tree.reward(queen_ending, 0) == 1, "The table's won ending should be rewarded 1."
+            endgame_rewards = ParallelMCTS.rollouts(chess.STARTING_FEN, [], chess.WHITE, (1, 1, 5, [1] * 6, 1.5), 1, 0)
+            assert endgame_rewards[0] != 1, "A rollout from the start should not be a known win."
+            endgame_rewards = ParallelMCTS.rollouts(queen_ending.root().fen(), queen_ending.move_stack, chess.WHITE,
+                                                    (1, 1, 5, [1] * 6, 1.5), 3, 0)
+            assert endgame_rewards == [1, 1, 1], f"Rollouts of the won ending are {endgame_rewards}."
+        finally:
+            Player.Player.endgames = default_tables
+    passed += 1
+
+    # The UCI front end finds the mate, and stop ends an infinite search with a legal move straight away.
+    uci_output = io.StringIO()
+    engine = UCI.UCIEngine(uci_output)
+    engine.handle("position fen 1k6/3R4/2Q5/8/8/8/8/1K6 w - - 0 2")
+    engine.handle("go depth 2")
+    engine.handle("stop")
+    assert "bestmove c6b7" in uci_output.getvalue(), f"UCI output is {uci_output.getvalue()!r}."
+    engine.handle("position startpos moves e2e4")
+    engine.handle("go infinite")
+    time.sleep(0.2)
+    stop_start = time.perf_counter()
+    engine.handle("stop")
+    stop_time = time.perf_counter() - stop_start
+    uci_move = chess.Move.from_uci(uci_output.getvalue().split()[-1])
+    assert uci_move in chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1").legal_moves, f"Best move is {uci_move}."
+    assert stop_time < 1, f"Stopping took {stop_time}s."
+    assert 0 < UCI.move_time(UCI.parse_go("wtime 60000 btime 1000 winc 1000".split()), chess.BLACK) < 0.5
+    engine.handle("quit")
+    passed += 1
+
+    # go nodes and go depth end on their own with every player.
+    for uci_player, threads in (("MMPlayer", 1), ("MCTSPlayer", 1), ("MCTSPlayer", 2)):
+        uci_output = io.StringIO()
+        engine = UCI.UCIEngine(uci_output)
+        engine.handle(f"setoption name Player value {uci_player}")
+        engine.handle(f"setoption name Threads value {threads}")
+        engine.handle("setoption name OwnBook value false")
+        engine.handle("position startpos moves e2e4")
+        for go in ("go nodes 20", "go depth 1"):
+            engine.handle(go)
+            engine.thread.join(30)
+            assert not engine.thread.is_alive(), f"{go} with {uci_player} and {threads} threads did not finish."
+            assert uci_output.getvalue().count("bestmove") == 1 + (go == "go depth 1"), f"UCI output is {uci_output.getvalue()!r}."
+            if uci_player == "MCTSPlayer" and threads == 1:
+                limit = 20 if go == "go nodes 20" else UCI.MCTS_ITERATIONS_PER_DEPTH
+                assert engine.player.iter == limit, f"{go} ran {engine.player.iter} iterations, should be {limit}."
+        engine.handle("quit")
+    passed += 1
+
+    # The tree of the chosen move is reused after the opponent's reply, and dropped after any other game.
+    tree = MCTS.MCTSPlayer()
+    tree.max_iterations = 200
+    tree.setPlayer(chess.WHITE)
+    tree_board = chess.Board()
+    tree.search(tree_board)
+    tree_board.push(tree.choose())
+    reply = max(tree.root.children, key=lambda child: child.Nt)
+    reply_visits = reply.Nt
+    tree_board.push(reply.move)
+    reused = tree.reuse(tree_board)
+    assert reused is reply and reused.Nt == reply_visits > 0, f"Reused root is {reused!r}, should be {reply!r}."
+    assert reused.parent is None, "The reused root still has a parent."
+    other_board = chess.Board()
+    other_board.push(next(move for move in other_board.legal_moves if move != tree_board.move_stack[0]))
+    other_board.push(next(iter(other_board.legal_moves)))
+    fresh = tree.reuse(other_board)
+    assert fresh.Nt == 0 and not fresh.children, f"Root of another game is {fresh!r}, should be new."
+    passed += 1
+
+    # Both parallel modes choose a legal move within the iteration limit, and the root visits merged from the
+    # workers' trees are every rollout of every worker's iterations.
+    parallel_board = chess.Board("rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1")
+    for mode, workers in (("root", 1), ("leaf", 1), ("root", 2)):
+        parallel = ParallelMCTS.ParallelMCTSPlayer(exploreMoves=2, max_depth=2, workers=workers, mode=mode, batch_size=4)
+        parallel.max_iterations = 10
+        parallel.setPlayer(chess.BLACK)
+        try:
+            parallel_move = parallel.MCTS_choice(parallel_board)
+        finally:
+            parallel.close()
+        assert parallel_board.is_legal(parallel_move), f"{mode} parallel move {parallel_move} is not legal."
+        # Leaf batches stop at the iteration limit rather than at a whole batch.
+        assert parallel.iter == 10, f"{mode} parallel with {workers} workers ran {parallel.iter} iterations, should be 10."
+        if mode == "root":
+            visits = sum(Nt for Nt, Qt in parallel.rootVisits.values())
+            assert visits == parallel.iter * 2, f"Merged root visits are {visits}, should be {parallel.iter * 2}."
+    passed += 1
+
+    # A knockout of four players returns one of them as the champion and breeds a population of the same size.
+    with tempfile.TemporaryDirectory() as directory:
+        evolution_store = os.path.join(directory, "evolution.games")
+        evolution = GeneticAlgorithm.Evolution(1, .5, 4, 6, workers=1, seed=0, game_time=3, depth=1,
+                                               store_path=evolution_store)
+        population = evolution.pop.copy()
+        with contextlib.redirect_stdout(io.StringIO()):
+            champion = evolution.run()[0]
+        assert evolution.store.file is None, "The game store was left open after the run."
+        evolution_games = len(GameStore.GameStore(evolution_store))
+    assert any((champion == weights).all() for weights in population), f"Champion {champion} is not in the population."
+    assert evolution.pop.shape == (4, 6), f"Next population has shape {evolution.pop.shape}, should be (4, 6)."
+    assert evolution_games == 3, f"The store has {evolution_games} games, should be 3."
+    passed += 1
+
+    # Search statistics are filled in for every move of both kinds of player and written
+    # to the sink, and a game that does not record them leaves the players without any.
+    with tempfile.TemporaryDirectory() as directory:
+        stats_path = os.path.join(directory, "stats.jsonl")
+        sink = SearchStats.JsonLinesSink(stats_path)
+        stats_tree = MCTS.MCTSPlayer(max_time=5)
+        stats_tree.max_iterations = 20
+        stats_game = ChessGame.Game(Player.MMPlayer(2), stats_tree, chess.Board(kiwipete), record_stats=True, stats_sink=sink)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(4):
+                stats_game.nextTurn()
+        sink(stats_game.stats_summary()["total"])
+        sink.close()
+        with open(stats_path) as file:
+            stats_lines = [json.loads(line) for line in file]
+    assert len(stats_game.move_stats) == 4 and len(stats_lines) == 5, f"Wrote {len(stats_lines)} lines for 4 moves."
+    for record in stats_game.move_stats:
+        if record["player"] == "white":
+            assert record["nodes"] > 0 and record["evaluations"] > 0 and record["cutoffs"] > 0, f"Minimax statistics are {record}."
+        else:
+            assert record["iterations"] == 20 and record["tree_size"] > 0 and record["evaluations"] > 0, \
+                f"Tree search statistics are {record}."
+    assert stats_lines[:4] == stats_game.move_stats and stats_lines[4]["moves"] == 4, f"Summary is {stats_lines[4]}."
+    quiet_game = ChessGame.Game(Player.MMPlayer(1), Player.MMPlayer(1), chess.Board(kiwipete))
+    with contextlib.redirect_stdout(io.StringIO()):
+        quiet_game.nextTurn()
+    assert quiet_game.white.stats is None and quiet_game.white.stats_callback is None and not quiet_game.move_stats
+    passed += 1
+
+    # The compiled opening book has the moves of eco.json.
+    book_moves = Player.Player.book.moves(chess.Board())
+    assert chess.Move.from_uci("e2e4") in book_moves, f"Book moves are {book_moves}, should include e2e4."
+    passed += 1
+
     print(f"{passed} tests passed")
@@ -0,0 +1,90 @@
+import sys
+
+import chess
+import chess.polyglot
+
+import SearchBoard
+
+# Bound types of a stored value.
+# The value is the exact minimax value of the position.
+EXACT = 0
+# The search failed high, the true value is at least the stored value.
+LOWER = 1
+# The search failed low, the true value is at most the stored value.
+UPPER = 2
+
+
+def zobrist_key(board: chess.Board):
+    """Zobrist hash of the board, the same key used by polyglot opening books."""
+    if isinstance(board, SearchBoard.SearchBoard):
+        # Kept up to date as moves are made.
+        return board.key
+    return chess.polyglot.zobrist_hash(board)
+
+
+class TranspositionTable():
+    """Fixed size hash table of previously searched positions.
+
+    Entries are kept in a list of slots indexed by the Zobrist key,
+    so the table never grows past the size it was created with."""
+
+    # Rough number of bytes a single stored entry costs,
+    # the slot in the list plus a tuple of seven small values.
+    ENTRY_SIZE = 8 + sys.getsizeof((0,) * 7) + 7 * 28
+
+    def __init__(self, size_mb=16):
+        """Create an empty table that uses at most about size_mb megabytes."""
+        self.size = max(1, int(size_mb * 1024 * 1024) // TranspositionTable.ENTRY_SIZE)
+        self.slots = [None] * self.size
+        # Search generation, entries from older searches are replaced first.
+        self.generation = 0
+        self.hits = 0
+        self.probes = 0
+        self.stores = 0
+
+    def clear(self):
+        """Remove every entry from the table."""
+        self.slots = [None] * self.size
+        self.generation = 0
+
+    def new_search(self):
+        """Mark the start of a new search so older entries age out."""
+        self.generation += 1
+
+    def probe(self, key):
+        """Return the entry (key, depth, bound, value, move, distance, generation)
+        stored for the key or None."""
+        self.probes += 1
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, bound, value, move, distance):
+        """Store a searched position.
+
+        depth is the remaining depth that was searched below the position and
+        distance is how many plies below the position the value was found.
+        The slot is replaced if it is empty, holds the same position,
+        is from an older search or was searched less deeply."""
+        index = key % self.size
+        entry = self.slots[index]
+        if entry is not None and entry[0] != key and entry[6] == self.generation and entry[1] > depth:
+            return
+        if entry is not None and entry[0] == key and move is None:
+            # Keep the best move of a previous search of this position.
+            move = entry[4]
+        self.stores += 1
+        self.slots[index] = (key, depth, bound, value, move, distance, self.generation)
+
+    def best_move(self, key):
+        """Return the best move stored for the key or None."""
+        entry = self.slots[key % self.size]
+        if entry is not None and entry[0] == key:
+            return entry[4]
+        return None
+
+    def hit_rate(self):
+        """Fraction of probes that found an entry."""
+        return self.hits / self.probes if self.probes else 0
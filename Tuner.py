@@ -0,0 +1,198 @@
+import argparse
+import json
+import re
+
+import numpy as np
+import chess
+import chess.pgn
+
+import Player
+import Evaluation
+import GameStore
+
+# Score of each game result from white's point of view.
+RESULTS = {"1-0" : 1.0, "0-1" : 0.0, "1/2-1/2" : 0.5}
+# Results written at the end of an EPD line, as c9 "1-0"; or as [1.0].
+EPD_RESULT = re.compile(r'(?:c9\s+"(1-0|0-1|1/2-1/2)"|\[(1\.0|0\.5|0\.0)\])\s*;?\s*$')
+
+
+def read_pgn(path, skip=8, max_games=None):
+    """Every position of the finished games in a PGN file and the game's result,
+       leaving out the first skip moves of each game, which mostly come from the book."""
+    boards = []
+    results = []
+    with open(path, "r") as file:
+        games = 0
+        while max_games is None or games < max_games:
+            game = chess.pgn.read_game(file)
+            if game is None:
+                break
+            result = RESULTS.get(game.headers.get("Result"))
+            if result is None:
+                # Unfinished games have nothing to learn from.
+                continue
+            games += 1
+            board = game.board()
+            for ply, move in enumerate(game.mainline_moves()):
+                board.push(move)
+                if ply + 1 >= skip:
+                    boards.append(board.copy(stack=False))
+                    results.append(result)
+    return boards, np.array(results)
+
+
+def read_epd(path):
+    """Positions and results of an EPD file with one labelled position per line."""
+    boards = []
+    results = []
+    with open(path, "r") as file:
+        for line in file:
+            match = EPD_RESULT.search(line)
+            if match is None:
+                continue
+            fields = line[:match.start()].split()
+            board = chess.Board(" ".join(fields[:4]) + " 0 1")
+            boards.append(board)
+            results.append(RESULTS[match.group(1)] if match.group(1) else float(match.group(2)))
+    return boards, np.array(results)
+
+
+def features(boards, protects_counts_threats=False, chunk_size=65536):
+    """The (N, 6) matrix of Player.heuristics features of each board from white's point of view."""
+    chunks = [Evaluation.batch_heuristics(boards[i:i + chunk_size], chess.WHITE, Player.Player.piece_square_table,
+                                          protects_counts_threats)
+              for i in range(0, len(boards), chunk_size)]
+    return np.concatenate(chunks) if chunks else np.zeros((0, 6))
+
+
+def sigmoid(x):
+    return 0.5 * (1 + np.tanh(0.5 * x))
+
+
+class Tuner():
+    """Fits the heuristic weights to game results, Texel style.
+
+    The heuristic value of a board is turned into an expected score for white
+    by a sigmoid and the weights are fitted to minimize the squared error
+    between the expected score and the result of the game the board is from.
+    The features are computed once, so every step of the fit is a few matrix
+    products. A part of the positions is held back to stop the fit once it
+    no longer improves on them."""
+
+    def __init__(self, boards=None, results=None, matrix=None, validation=0.1, seed=None,
+                 protects_counts_threats=False):
+        """boards and results are the labelled positions, results from white's point of view.
+           matrix is their feature matrix if it is already computed."""
+        self.rng = np.random.default_rng(seed)
+        if matrix is None:
+            matrix = features(boards, protects_counts_threats)
+        self.matrix = np.asarray(matrix, dtype=float)
+        self.results = np.asarray(results, dtype=float)
+        # Split the positions into the ones fitted and the ones held back.
+        order = self.rng.permutation(len(self.results))
+        held = int(len(order) * validation)
+        self.train = order[held:]
+        self.validation = order[:held] if held else order
+        # Loss on the held back positions after every epoch of the last fit.
+        self.history = []
+
+    def loss(self, theta, rows=None):
+        """Mean squared error of the expected scores of the rows with parameters theta."""
+        rows = self.train if rows is None else rows
+        predictions = sigmoid(self.matrix[rows] @ theta)
+        return float(np.mean((predictions - self.results[rows]) ** 2))
+
+    def scale(self, weights):
+        """The factor the normalized weights are multiplied by before the sigmoid
+           that best fits the results, found by searching a range of scales at once."""
+        weights = np.asarray(weights, dtype=float) / np.sum(weights)
+        scales = np.logspace(-3, 1, 200)
+        values = self.matrix[self.train] @ weights
+        predictions = sigmoid(np.outer(scales, values))
+        errors = np.mean((predictions - self.results[self.train]) ** 2, axis=1)
+        return scales[np.argmin(errors)]
+
+    def fit(self, weights=None, epochs=200, batch_size=4096, learning_rate=0.01, patience=10, tol=1e-7):
+        """Fit the weights with mini-batch Adam, starting from weights (Player.weights by default).
+           Stops after patience epochs without the held back loss improving by tol.
+           Returns the weights for MMPlayer(weights=...), scaled to the range the
+           genetic algorithm uses, and the held back loss before and after."""
+        if weights is None:
+            weights = Player.Player.weights
+        weights = np.asarray(weights, dtype=float)
+        # The players normalize the weights, so only their direction is fitted
+        # and the sigmoid's scale is part of the parameters.
+        theta = weights / weights.sum() * self.scale(weights)
+        first = np.zeros_like(theta)
+        moment = np.zeros_like(theta)
+        best = theta.copy()
+        best_loss = start_loss = self.loss(theta, self.validation)
+        self.history = []
+        step = 0
+        waited = 0
+        for epoch in range(epochs):
+            order = self.rng.permutation(self.train)
+            for i in range(0, len(order), batch_size):
+                rows = order[i:i + batch_size]
+                x = self.matrix[rows]
+                predictions = sigmoid(x @ theta)
+                # Gradient of the squared error through the sigmoid.
+                error = (predictions - self.results[rows]) * predictions * (1 - predictions)
+                gradient = 2 * x.T @ error / len(rows)
+                step += 1
+                first = 0.9 * first + 0.1 * gradient
+                moment = 0.999 * moment + 0.001 * gradient ** 2
+                theta = theta - learning_rate * (first / (1 - 0.9 ** step)) / (np.sqrt(moment / (1 - 0.999 ** step)) + 1e-8)
+                # The players need weights that are not negative.
+                theta = np.maximum(theta, 0)
+            loss = self.loss(theta, self.validation)
+            self.history.append(loss)
+            if loss < best_loss - tol:
+                best = theta.copy()
+                best_loss = loss
+                waited = 0
+            else:
+                waited += 1
+                if waited >= patience:
+                    break
+        if not best.any():
+            # Every feature was fitted away, keep the weights it started from.
+            best = weights
+        return best * 5 / best.max(), start_loss, best_loss
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fit the heuristic weights to the results of finished games.")
+    parser.add_argument("positions", help="PGN file of finished games, an EPD file with --epd "
+                                          "or the prefix of GameStore.export arrays with --dataset")
+    parser.add_argument("--epd", action="store_true", help="the positions are an EPD file with results")
+    parser.add_argument("--dataset", action="store_true", help="the positions are arrays written by GameStore.export")
+    parser.add_argument("--skip", type=int, default=8, help="opening moves of each PGN game to leave out")
+    parser.add_argument("--epochs", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=4096)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--patience", type=int, default=10, help="epochs without improvement before stopping")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write the weights to this file as JSON")
+    args = parser.parse_args(argv)
+
+    if args.dataset:
+        rows, matrix, results, games = GameStore.load(args.positions)
+        tuner = Tuner(results=results, matrix=matrix, seed=args.seed)
+    else:
+        if args.epd:
+            boards, results = read_epd(args.positions)
+        else:
+            boards, results = read_pgn(args.positions, args.skip)
+        tuner = Tuner(boards, results, seed=args.seed)
+    weights, start_loss, loss = tuner.fit(epochs=args.epochs, batch_size=args.batch_size,
+                                          learning_rate=args.learning_rate, patience=args.patience)
+    print(f"{len(results)} positions, held back loss {start_loss:.6f} -> {loss:.6f} after {len(tuner.history)} epochs")
+    print(weights.tolist())
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(weights.tolist(), file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+import math
+import sys
+import threading
+
+import chess
+
+import Player
+import MCTS
+import ParallelMCTS
+import TranspositionTable
+
+# Options shown to the GUI, as (name, type, default, minimum or choices, maximum).
+OPTIONS = [
+    ("Hash", "spin", 16, 0, 1024),
+    ("Threads", "spin", 1, 1, 64),
+    ("Player", "combo", "MMPlayer", ("MMPlayer", "MCTSPlayer"), None),
+    ("Backend", "combo", "python-chess", Player.SearchingPlayer.BACKENDS, None),
+    ("OwnBook", "check", True, None, None),
+    ("Move Overhead", "spin", 50, 0, 5000)
+]
+# Moves the rest of the game is expected to take when the clock gives no movestogo.
+MOVES_TO_GO = 30
+# Iterations the tree search runs per ply of go depth, a tree grown by sampling has no depth to stop at.
+MCTS_ITERATIONS_PER_DEPTH = 50
+
+
+def parse_go(tokens):
+    """The limits of a go command as a dictionary, numbers as ints and flags as True."""
+    limits = {}
+    i = 0
+    while i < len(tokens):
+        name = tokens[i]
+        if name in ("infinite", "ponder"):
+            limits[name] = True
+        elif name == "searchmoves":
+            # The moves run to the end of the command, the search always looks at every move.
+            limits[name] = tokens[i + 1:]
+            break
+        elif i + 1 < len(tokens):
+            limits[name] = int(tokens[i + 1])
+            i += 1
+        i += 1
+    return limits
+
+
+def move_time(limits, turn, overhead=0.05):
+    """Seconds to search a move for the limits of a go command, inf for no time limit."""
+    if "movetime" in limits:
+        return max(limits["movetime"] / 1000 - overhead, 0.01)
+    remaining = limits.get("wtime" if turn == chess.WHITE else "btime")
+    if remaining is None or limits.get("infinite"):
+        return math.inf
+    remaining /= 1000
+    increment = limits.get("winc" if turn == chess.WHITE else "binc", 0) / 1000
+    moves = limits.get("movestogo") or MOVES_TO_GO
+    budget = remaining / moves + increment * 0.75
+    # Never use more than half of what is left on the clock.
+    return max(min(budget, remaining / 2) - overhead, 0.01)
+
+
+class UCIEngine():
+    """The players behind the Universal Chess Interface.
+
+    Commands are read on the calling thread and every search runs in a
+    worker thread, so stop and isready are answered while it searches.
+    Stopping sets the player's stopEvent, which ends the search at its next
+    clock check with the best move found so far."""
+
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.options = {name : default for name, kind, default, low, high in OPTIONS}
+        self.board = chess.Board()
+        # Made on first use, and again after an option that changes it.
+        self.player = None
+        self.thread = None
+        # Whether bestmove waits for stop, as go infinite and go ponder must.
+        self.wait_for_stop = False
+        self.stopped = threading.Event()
+
+    def send(self, line):
+        self.output.write(line + "\n")
+        self.output.flush()
+
+    def make_player(self):
+        """The player the options describe."""
+        workers = self.options["Threads"]
+        if self.options["Player"] == "MCTSPlayer":
+            if workers > 1:
+                player = ParallelMCTS.ParallelMCTSPlayer(workers=workers, mode="leaf")
+                # Start the workers now, a process forked while stdin is being read
+                # waits forever for the lock the reading thread holds on it.
+                player.getPool().submit(int).result()
+            else:
+                player = MCTS.MCTSPlayer()
+        else:
+            # The minimax search runs in one thread whatever Threads is.
+            player = Player.MMPlayer(None, hash_size=self.options["Hash"], max_time=math.inf)
+        player.board_backend = self.options["Backend"]
+        return player
+
+    def handle(self, line):
+        """Carry out one command. Returns False once the engine should quit."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name Chess AI")
+            self.send("id author Victoria Rios, Zachery McCurtain, Ross Gander")
+            for name, kind, default, low, high in OPTIONS:
+                if kind == "spin":
+                    self.send(f"option name {name} type spin default {default} min {low} max {high}")
+                elif kind == "combo":
+                    self.send(f"option name {name} type combo default {default} " + " ".join(f"var {v}" for v in low))
+                else:
+                    self.send(f"option name {name} type check default {str(default).lower()}")
+            self.send("uciok")
+        elif command == "isready":
+            if self.player is None:
+                self.player = self.make_player()
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(arguments)
+        elif command == "ucinewgame":
+            self.stop()
+            self.close_player()
+        elif command == "position":
+            self.stop()
+            self.board = self.parse_position(arguments)
+        elif command == "go":
+            self.go(parse_go(arguments))
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            self.stop()
+            self.close_player()
+            return False
+        return True
+
+    def set_option(self, arguments):
+        """setoption name <name> value <value>, names may have spaces."""
+        if "value" in arguments:
+            name = " ".join(arguments[1:arguments.index("value")])
+            value = " ".join(arguments[arguments.index("value") + 1:])
+        else:
+            name = " ".join(arguments[1:])
+            value = None
+        for option, kind, default, low, high in OPTIONS:
+            if option.lower() != name.lower():
+                continue
+            if kind == "spin":
+                value = min(max(int(value), low), high)
+            elif kind == "check":
+                value = value == "true"
+            elif value not in low:
+                return
+            self.stop()
+            self.options[option] = value
+            self.close_player()
+            return
+
+    def close_player(self):
+        if isinstance(self.player, ParallelMCTS.ParallelMCTSPlayer):
+            self.player.close()
+        self.player = None
+
+    def parse_position(self, arguments):
+        """position [startpos | fen <fen>] [moves <moves>...]"""
+        moves = arguments.index("moves") if "moves" in arguments else len(arguments)
+        if arguments and arguments[0] == "fen":
+            board = chess.Board(" ".join(arguments[1:moves]))
+        else:
+            board = chess.Board()
+        for move in arguments[moves + 1:]:
+            board.push_uci(move)
+        return board
+
+    def go(self, limits):
+        """Start searching the current board in the worker thread."""
+        self.stop()
+        if self.player is None:
+            self.player = self.make_player()
+        self.wait_for_stop = bool(limits.get("infinite") or limits.get("ponder"))
+        self.stopped.clear()
+        self.player.stopEvent.clear()
+        self.thread = threading.Thread(target=self.think, args=(self.board.copy(), limits), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the search and wait for it to send its move."""
+        if self.thread is None:
+            return
+        self.wait_for_stop = False
+        self.player.stopEvent.set()
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def think(self, board, limits):
+        """Find a move for the board within the limits and send it."""
+        player = self.player
+        player.setPlayer(board.turn)
+        move = None
+        if not self.wait_for_stop:
+            if self.options["OwnBook"]:
+                move = Player.Player.book.choice(board)
+            if move is None:
+                move = Player.Player.endgames.best_move(board)
+        if move is None and any(board.generate_legal_moves()):
+            move = self.search(player, board, limits)
+        # Infinite searches only answer once they are stopped.
+        if self.wait_for_stop:
+            self.stopped.wait()
+        self.send(f"bestmove {move.uci() if move else '0000'}")
+
+    def search(self, player, board, limits):
+        """The move the player finds for the board within the limits."""
+        seconds = move_time(limits, board.turn, self.options["Move Overhead"] / 1000)
+        if self.wait_for_stop:
+            seconds = math.inf
+        if isinstance(player, MCTS.MCTSPlayer):
+            player.time = seconds
+            # go nodes counts the tree's iterations, the smaller limit applies if depth is given too.
+            iterations = [limits[name] * scale for name, scale in (("nodes", 1), ("depth", MCTS_ITERATIONS_PER_DEPTH))
+                          if name in limits]
+            player.max_iterations = min(iterations) if iterations else None
+            return player.MCTS_choice(board)
+        player.max_time = seconds
+        player.maxDepth = limits.get("depth")
+        player.max_nodes = limits.get("nodes")
+
+        def info(depth, value, depthfound, nodes, pv):
+            if value == player.WINSCORE:
+                score = f"mate {(depthfound + 1) // 2}"
+            elif value == player.LOSESCORE:
+                score = f"mate {-(depthfound // 2)}"
+            else:
+                score = f"cp {round(value * 100)}"
+            self.send(f"info depth {depth} score {score} nodes {nodes} pv {' '.join(m.uci() for m in pv)}")
+
+        player.iteration_callback = info
+        try:
+            move = player.search(board)
+        finally:
+            player.iteration_callback = None
+        if move is None:
+            # Stopped before the first iteration finished.
+            move = player.table.best_move(TranspositionTable.zobrist_key(board)) if player.table is not None else None
+            if move is None or not board.is_legal(move):
+                move = next(iter(board.legal_moves))
+        return move
+
+    def run(self, input=sys.stdin):
+        """Read and carry out commands until quit or the end of the input."""
+        for line in input:
+            if not self.handle(line):
+                break
+        else:
+            self.stop()
+            self.close_player()
+
+
+def main():
+    # Anything the players print goes to stderr, stdout only carries the protocol.
+    output = sys.stdout
+    sys.stdout = sys.stderr
+    UCIEngine(output).run()
+
+
+if __name__ == '__main__':
+    main()